@@ -1,13 +1,21 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 from trytond.pool import Pool
-from . import production
+from . import configuration, ir, production, stock
 
 
 def register():
     Pool.register(
+        configuration.Configuration,
+        ir.Cron,
         production.Production,
+        production.SplitLog,
+        production.SplitRule,
         production.SplitProductionStart,
+        production.SplitProductionPreview,
+        production.SplitProductionPreviewProduction,
+        production.SplitProductionPreviewMove,
+        stock.Move,
         module='production_split_unexploded', type_='model')
     Pool.register(
         production.SplitProduction,
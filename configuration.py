@@ -0,0 +1,38 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+from trytond.model import fields
+from trytond.pool import PoolMeta
+
+__all__ = ['Configuration']
+
+
+class Configuration(metaclass=PoolMeta):
+    __name__ = 'production.configuration'
+    split_chunk_size = fields.Integer('Split Chunk Size',
+        domain=['OR',
+            ('split_chunk_size', '=', None),
+            ('split_chunk_size', '>', 0),
+            ],
+        help='Number of productions created at once by the splits run in '
+        'background.')
+    split_batch_size = fields.Integer('Split Batch Size',
+        domain=['OR',
+            ('split_batch_size', '=', None),
+            ('split_batch_size', '>', 0),
+            ],
+        help='Number of productions split by each task when many '
+        'productions are split in background.')
+
+    @staticmethod
+    def default_split_chunk_size():
+        return 100
+
+    def get_split_chunk_size(self):
+        return self.split_chunk_size or self.default_split_chunk_size()
+
+    @staticmethod
+    def default_split_batch_size():
+        return 10
+
+    def get_split_batch_size(self):
+        return self.split_batch_size or self.default_split_batch_size()
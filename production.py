@@ -1,22 +1,245 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-from trytond.model import ModelView, fields
+import logging
+import time
+import uuid
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from fractions import Fraction
+from itertools import accumulate
+
+from sql import For, Literal, Null
+from sql.conditionals import Coalesce
+
+from trytond import backend
+from trytond.model import (
+    Index, MatchMixin, ModelSQL, ModelView, dualmethod, fields,
+    sequence_ordered)
 from trytond.wizard import Wizard, StateView, StateTransition, Button
-from trytond.pyson import Eval
+from trytond.pyson import Eval, If
 from trytond.pool import Pool, PoolMeta
-from trytond.transaction import Transaction
+from trytond.rpc import RPC
+from trytond.transaction import Transaction, without_check_access
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
+from trytond.tools import grouped_slice, reduce_ids
+
+__all__ = ['Production', 'SplitLog', 'SplitRule', 'SplitProductionStart',
+    'SplitProductionPreview',
+    'SplitProductionPreviewProduction', 'SplitProductionPreviewMove',
+    'SplitProduction']
+logger = logging.getLogger(__name__)
+
+# The values of a move read once at the start of the split, lot is the id of
+# the lot of the move if stock_lot is activated
+SplitMove = namedtuple('SplitMove', [
+        'move', 'key', 'product', 'quantity', 'state', 'unit', 'default_uom',
+        'lot'])
+
+
+def largest_remainder(total, weights):
+    """
+    Distribute the integer <total> proportionally to <weights> using the
+    largest remainder method, so the result always sums <total>.
+    """
+    weights = list(weights)
+    weight = sum(weights)
+    if not weight:
+        return [0] * len(weights)
+    parts = [Fraction(total) * w / weight for w in weights]
+    result = [int(p) for p in parts]
+    # Give the steps left to the parts with the largest remainder, the first
+    # ones on equality
+    order = sorted(range(len(parts)), key=lambda i: result[i] - parts[i])
+    for i in order[:total - sum(result)]:
+        result[i] += 1
+    return result
+
+
+class UomConverter(object):
+    """
+    Convert quantities between units like compute_qty of product.uom with
+    round=False does but getting the factor or rate of each pair of units only
+    once, so it can be shared by all the conversions of a split.
+    """
+
+    def __init__(self):
+        self._operations = {}
+
+    def __call__(self, from_uom, qty, to_uom):
+        if not qty or from_uom == to_uom:
+            return qty
+        key = (from_uom.id, to_uom.id)
+        operations = self._operations.get(key)
+        if operations is None:
+            operations = self._operations[key] = self._get_operations(
+                from_uom, to_uom)
+        (from_factor, from_value), (to_factor, to_value) = operations
+        # Same operations than compute_qty to get the same rounding
+        if from_factor:
+            amount = qty * from_value
+        else:
+            amount = qty / from_value
+        if to_factor:
+            return amount / to_value
+        else:
+            return amount * to_value
+
+    @staticmethod
+    def _get_operations(from_uom, to_uom):
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        # Raise the same errors than compute_qty for not convertible units
+        Uom.compute_qty(from_uom, 1, to_uom, round=False)
+        operations = []
+        for uom in [from_uom, to_uom]:
+            if uom.accurate_field == 'factor':
+                operations.append((True, uom.factor))
+            else:
+                operations.append((False, uom.rate))
+        return operations
+
+
+class SplitIndex(object):
+    """
+    Group SplitMoves by their key keeping their order, with the quantity of
+    each one in the default unit of its product and the cumulative quantity
+    at its end, so the moves at a position of a key are found by bisection
+    instead of scanning them.
+    """
+
+    def __init__(self, moves, convert=None):
+        if convert is None:
+            convert = UomConverter()
+        self._moves, self._quantities, self._ends = {}, {}, {}
+        for move in moves:
+            self._moves.setdefault(move.key, []).append(move)
+            self._quantities.setdefault(move.key, []).append(
+                Fraction(convert(move.unit, move.quantity, move.default_uom)))
+        for key in self._moves:
+            self._ends[key] = list(accumulate(self._quantities[key]))
+
+    def keys(self):
+        return list(self._moves)
+
+    def moves(self, key):
+        return self._moves[key]
+
+    def quantities(self, key):
+        return self._quantities[key]
 
-__all__ = ['Production', 'SplitProductionStart', 'SplitProduction']
+    def total(self, key):
+        ends = self._ends[key]
+        return ends[-1] if ends else Fraction(0)
+
+    def reorder(self, key, moves, quantities):
+        "Lay the moves of key in the order of <moves> and <quantities>"
+        self._moves[key] = list(moves)
+        self._quantities[key] = list(quantities)
+        self._ends[key] = list(accumulate(quantities))
+
+    def span(self, key, i):
+        "Return the cumulative start and end of the move of key at index <i>"
+        end = self._ends[key][i]
+        return end - self._quantities[key][i], end
+
+    def find(self, key, position):
+        "Return the index of the move of key at the cumulative <position>"
+        return min(bisect_right(self._ends[key], position),
+            len(self._ends[key]) - 1)
+
+
+class SplitInstrument(object):
+    """
+    Measure the time and the number of queries of each phase of a split.
+    The queries are only counted inside counting() on SQLite and PostgreSQL.
+    """
+    phases = ['planning', 'numbering', 'creation', 'inputs', 'outputs',
+        'state']
+
+    def __init__(self):
+        self.times = dict.fromkeys(self.phases, 0.)
+        self.queries = dict.fromkeys(self.phases, 0)
+        self._queries = 0
+
+    @contextmanager
+    def phase(self, name):
+        start, queries = time.perf_counter(), self._queries
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+            self.queries[name] += self._queries - queries
+
+    @contextmanager
+    def counting(self):
+        connection = Transaction().connection
+        if hasattr(connection, 'set_trace_callback'):
+            # SQLite
+            connection.set_trace_callback(self._count)
+            try:
+                yield
+            finally:
+                backend_logger = logging.getLogger(
+                    'trytond.backend.sqlite.database')
+                connection.set_trace_callback(
+                    backend_logger.debug
+                    if backend_logger.isEnabledFor(logging.DEBUG) else None)
+        elif hasattr(connection, 'cursor_factory'):
+            # PostgreSQL: the cursors created meanwhile count their queries
+            cursor_factory = connection.cursor_factory
+            count = self._count
+
+            class CountingCursor(cursor_factory):
+                def execute(self, query, vars=None):
+                    count()
+                    return super().execute(query, vars)
+
+            connection.cursor_factory = CountingCursor
+            try:
+                yield
+            finally:
+                connection.cursor_factory = cursor_factory
+        else:
+            yield
+
+    def _count(self, *args):
+        self._queries += 1
 
 
 class Production(metaclass=PoolMeta):
     __name__ = 'production'
+    split_state = fields.Selection([
+            (None, ''),
+            ('queued', 'Queued'),
+            ('running', 'Running'),
+            ], 'Split State', readonly=True,
+        help='State of the split running in background.')
+    split_progress = fields.Float('Split Progress', digits=(16, 2),
+        readonly=True,
+        help='Percentage of the productions already created by the split '
+        'running in background.')
+    split_done = fields.Integer('Split Done', readonly=True,
+        help='Number of productions already created by the split by chunks '
+        'which is running or was interrupted.')
+    split_origin = fields.Many2One('production', 'Split Origin',
+        readonly=True, ondelete='SET NULL',
+        help='The production this one was split from.')
+    split_children = fields.One2Many('production', 'split_origin',
+        'Split Productions', readonly=True,
+        help='The productions split from this one.')
 
     @classmethod
     def __setup__(cls):
         super(Production, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.split_origin, Index.Range()),
+                where=t.split_origin != Null))
+        cls.__rpc__.update({
+                'split_entries': RPC(readonly=False),
+                })
         cls._buttons.update({
                 'split_wizard': {
                     'readonly': ~Eval('state').in_(['request', 'draft',
@@ -29,171 +252,1756 @@ class Production(metaclass=PoolMeta):
     def split_wizard(cls, productions):
         pass
 
+    @classmethod
+    def _get_origin(cls):
+        # The production which supplies an input of another production
+        return super(Production, cls)._get_origin() | {'stock.move'}
+
+    @classmethod
+    def copy(cls, productions, default=None):
+        if default is None:
+            default = {}
+        else:
+            default = default.copy()
+        default.setdefault('split_state', None)
+        default.setdefault('split_progress', None)
+        default.setdefault('split_done', None)
+        default.setdefault('split_origin', None)
+        default.setdefault('split_children', None)
+        return super(Production, cls).copy(productions, default=default)
+
+    @classmethod
+    def create(cls, vlist):
+        productions = super(Production, cls).create(vlist)
+        if not Transaction().context.get('_production_split'):
+            # The productions without moves are split when they are set
+            cls.split_by_rules([p for p in productions
+                    if p.inputs or p.outputs])
+        return productions
+
+    @dualmethod
+    def set_moves(cls, productions):
+        super(Production, cls).set_moves(productions)
+        if not Transaction().context.get('_production_split'):
+            cls.split_by_rules(productions)
+
     def split_key(self, move):
         return move.product.id
 
-    def split(self, quantity, unit, count=None):
+    def split_keys(self, moves):
+        """
+        Return the split key of each of <moves>.
+        Override it to compute the keys of all the moves at once instead of
+        one by one with split_key.
+        """
+        return [self.split_key(m) for m in moves]
+
+    def _get_split_rule_pattern(self):
+        return {
+            'product': self.product.id if self.product else None,
+            'bom': self.bom.id if self.bom else None,
+            'warehouse': self.warehouse.id if self.warehouse else None,
+            }
+
+    @classmethod
+    def split_by_rules(cls, productions):
+        """
+        Split each of <productions> by the first production.split.rule it
+        matches, all of them at once like split_many does.
+        Return the splitted productions like split_many.
+        """
+        to_split = cls._split_rules_entries(productions)
+        if not to_split:
+            return []
+        return cls._split_each(to_split)
+
+    @classmethod
+    def split_by_rules_parallel(cls, productions=None):
+        """
+        Split in background like split_parallel each of <productions>, or all
+        the pending productions if not defined, by the first
+        production.split.rule it matches.
+        It is the method run by the cron of the nightly planning.
+        Return the identifiers of the batches.
+        """
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        if productions is None:
+            productions = cls.search([
+                    ('state', 'in', ['request', 'draft', 'waiting']),
+                    ('split_state', '=', None),
+                    ])
+        split2productions = defaultdict(list)
+        for production, quantity, unit, count in cls._split_rules_entries(
+                productions):
+            # Do not queue the productions which would not be split
+            if Uom.compute_qty(production.unit, production.quantity, unit,
+                    round=False) > quantity:
+                split2productions[(quantity, unit, count)].append(production)
+        return [cls.split_parallel(productions, quantity, unit, count)
+            for (quantity, unit, count), productions in (
+                split2productions.items())]
+
+    @classmethod
+    def _split_rules_entries(cls, productions):
+        """
+        Return the (production, quantity, unit, count) to split each of
+        <productions> by the first production.split.rule it matches.
+        """
+        pool = Pool()
+        Rule = pool.get('production.split.rule')
+
+        rules = Rule.search([])
+        if not rules:
+            return []
+        to_split = []
+        for production in productions:
+            if (production.state not in {'request', 'draft', 'waiting'}
+                    or not production.product
+                    or not production.quantity):
+                continue
+            pattern = production._get_split_rule_pattern()
+            for rule in rules:
+                if rule.match(pattern):
+                    if rule.unit.category == production.unit.category:
+                        to_split.append(
+                            (production, rule.quantity, rule.unit, rule.count))
+                    break
+        return to_split
+
+    def split(self, quantity, unit, count=None, cascade=False,
+            output_lots=False):
         """
         Split the production into productions of quantity.
         If count is not defined, the production will be split until the
         remainder is less than quantity.
+        The quantity can also be a list with the quantity of each production,
+        the production being split while the remainder is greater than the
+        next quantity.
         Return the splitted productions.
         The current production (self) will have the "remaining" quantities.
 
         If the initial production has more than one input for the same product,
         it will try to don't split these moves if it's not necessary.
+        If cascade is set, the productions which supply the inputs are split
+        in the same proportion.
+        If output_lots is set, the outputs of each new production get their
+        own lots.
+        """
+        return self.split_many([self], quantity, unit, count,
+            cascade=cascade, output_lots=output_lots)
+
+    @classmethod
+    def split_available(cls, productions):
+        """
+        Split off from each of <productions> a new production of the quantity
+        that can be produced with the stock available for its inputs, all of
+        them at once like split_many does.
+        The productions share the available stock in their order.
+        Return the splitted productions like split_many.
+        """
+        # The new productions take the reservation of the assigned moves
+        with Transaction().set_context(_split_assigned_first=True):
+            return cls._split_each([(p, [q] if q else [], p.unit, 1)
+                    for p, q in zip(productions,
+                        cls._split_available_quantities(productions))])
+
+    @classmethod
+    def _split_available_quantities(cls, productions):
+        """
+        Return for each of <productions> the quantity that can be produced
+        with the stock available, or None if it is all or nothing.
+        The inputs of each split key are available with their assigned
+        quantity and the stock of their products at their locations, which is
+        computed with a single query for all the productions of a company.
+        """
+        pool = Pool()
+        Product = pool.get('product.product')
+        Date = pool.get('ir.date')
+
+        convert = UomConverter()
+        production2moves = {}
+        company2pairs = defaultdict(set)
+        for production in productions:
+            if (production.state not in {'draft', 'waiting', 'assigned'}
+                    or not production.quantity):
+                continue
+            moves = production2moves[production] = production._split_snapshot(
+                [m for m in production.inputs
+                    if m.state in {'draft', 'assigned'}])
+            company2pairs[production.company.id].update(
+                (m.move.from_location.id, m.product) for m in moves
+                if m.state == 'draft')
+
+        # The stock which can be assigned
+        available = {}
+        for company, pairs in company2pairs.items():
+            if not pairs:
+                continue
+            location_ids, product_ids = map(list, map(set, zip(*pairs)))
+            with Transaction().set_context(company=company):
+                stock_date_end = Date.today()
+            with Transaction().set_context(
+                    stock_date_end=stock_date_end,
+                    stock_assign=True,
+                    company=company):
+                pbl = Product.products_by_location(location_ids,
+                    with_childs=True, grouping_filter=(product_ids,))
+            available.update(((company, l, p), Fraction(str(q)))
+                for (l, p), q in pbl.items() if (l, p) in pairs)
+
+        result = []
+        for production in productions:
+            moves = production2moves.get(production)
+            if not moves:
+                result.append(None)
+                continue
+            # The quantities are exact so the steps are not floored by the
+            # float error
+            key2needed = defaultdict(Fraction)
+            key2assigned = defaultdict(Fraction)
+            key2stocks = defaultdict(set)
+            for move in moves:
+                quantity = Fraction(str(
+                        convert(move.unit, move.quantity, move.default_uom)))
+                key2needed[move.key] += quantity
+                if move.state == 'assigned':
+                    key2assigned[move.key] += quantity
+                else:
+                    key2stocks[move.key].add((production.company.id,
+                            move.move.from_location.id, move.product))
+            ratio = 1
+            for key, needed in key2needed.items():
+                if needed > 0:
+                    stock = key2assigned[key] + sum(
+                        max(available.get(s, 0), 0) for s in key2stocks[key])
+                    ratio = min(ratio, stock / needed)
+
+            unit = production.unit
+            total = round(production.quantity / unit.rounding)
+            steps = int(total * ratio)
+            # Consume the stock for the next productions
+            for key, needed in key2needed.items():
+                consumed = needed * steps / total - key2assigned[key]
+                for stock in sorted(key2stocks[key]):
+                    if consumed <= 0:
+                        break
+                    quantity = min(max(available.get(stock, 0), 0), consumed)
+                    available[stock] = available.get(stock, 0) - quantity
+                    consumed -= quantity
+            if 0 < steps < total:
+                result.append(unit.round(steps * unit.rounding))
+            else:
+                result.append(None)
+        return result
+
+    def split_parts(self, parts, unit):
+        """
+        Split the production into <parts> productions of equal quantity, the
+        current production being the last one.
+        """
+        return self.split(self._split_parts_quantities(parts, unit), unit)
+
+    def _split_parts_quantities(self, parts, unit):
+        """
+        Return the list of quantities in unit of <parts> equal parts of the
+        production, they differ at most by the rounding of unit.
         """
         pool = Pool()
         Uom = pool.get('product.uom')
-        Production = pool.get('production')
 
-        initial = remainder = Uom.compute_qty(self.unit, self.quantity, unit)
-        if remainder <= quantity:
+        initial = Uom.compute_qty(self.unit, self.quantity, unit)
+        total = round(initial / unit.rounding)
+        return [unit.round(s * unit.rounding)
+            for s in largest_remainder(total, [1] * max(parts, 1))]
+
+    @classmethod
+    def split_many(cls, productions, quantity, unit, count=None,
+            callback=None, cascade=False, output_lots=False):
+        """
+        Split each of <productions> into productions of quantity like split
+        does but numbering, creating and moving the moves of all of them at
+        once.
+        If <cascade> is set, the productions which supply their inputs are
+        split in the same proportion, see _plan_split_upstream.
+        If <output_lots> is set, a lot is created for the outputs of each new
+        production, see _create_split_lots.
+        The time and queries of each phase are kept on a production.split.log
+        which is passed to <callback> if it is defined.
+        Return the splitted productions of all of them, each one followed by
+        the production it comes from, and then the upstream ones.
+        """
+        return cls._split_each([(p, quantity, unit, count)
+                for p in productions], callback, cascade, output_lots)
+
+    @classmethod
+    def _split_each(cls, to_split, callback=None, cascade=False,
+            output_lots=False):
+        """
+        Split the productions of <to_split>, a list of (production, quantity,
+        unit, count), at once like split_many does.
+        """
+        instrument = SplitInstrument()
+        with instrument.counting():
+            with instrument.phase('planning'):
+                cls._split_lock([p for p, _, _, _ in to_split])
+                plans = [(p, p._split_plan(quantity, unit, count))
+                    for p, quantity, unit, count in to_split]
+                links = []
+                if cascade:
+                    upstream, links = cls._plan_split_upstream(plans)
+                    plans.extend(upstream)
+            result = cls._apply_split_plans(
+                plans, instrument, links, output_lots)
+        cls._log_split(plans, instrument, callback)
+        return result
+
+    @classmethod
+    def _plan_split_upstream(cls, plans):
+        """
+        Plan the split of the productions upstream of <plans>, a list of
+        (production, plan), level by level until no production supplies the
+        inputs being split.
+        A production supplies the input which is its origin, it is split into
+        new productions for the fragments cut from the input, each one of the
+        quantity of the production in the same proportion as the fragment of
+        the input, and it keeps the part of the input which is not cut.
+        Return the list of (production, plan) of the upstream productions and
+        the list of (production, input, production of input, indexes) links
+        where the new productions of production supply the fragments of input
+        moved to the new productions at indexes.
+        """
+        upstream, links = [], []
+        seen = {p for p, _ in plans}
+        level = plans
+        while level:
+            move2fragments = defaultdict(list)
+            move2plan = {}
+            for production, plan in level:
+                if not plan:
+                    continue
+                fragments, _, move2qty = plan['inputs']
+                for move, index, quantity in fragments:
+                    move2fragments[move].append((index, quantity))
+                    move2plan[move] = (production, move2qty[move])
+            if not move2fragments:
+                break
+            id2move = {m.move.id: m for m in move2fragments}
+            suppliers = cls.search([
+                    ('origin', 'in', ['stock.move,%s' % i for i in id2move]),
+                    ('state', 'in', ['request', 'draft', 'waiting']),
+                    ])
+            cls._split_lock(suppliers)
+            level = []
+            for supplier in suppliers:
+                if supplier in seen or not supplier.quantity:
+                    continue
+                seen.add(supplier)
+                move = id2move[supplier.origin.id]
+                production, kept = move2plan[move]
+                fragments = sorted(move2fragments[move])
+                # The supplier is divided in rounding steps of its unit like
+                # the input, the last part being the one which is not cut
+                unit = supplier.unit
+                steps = largest_remainder(
+                    round(supplier.quantity / unit.rounding),
+                    [Fraction(q) for _, q in fragments] + [Fraction(kept)])
+                plan = supplier._split_plan(
+                    [unit.round(s * unit.rounding) for s in steps[:-1]], unit)
+                if not plan:
+                    continue
+                level.append((supplier, plan))
+                links.append((supplier, move, production,
+                        [i for i, _ in fragments[:plan['children']]]))
+            upstream.extend(level)
+        return upstream, links
+
+    @classmethod
+    def split_entries(cls, entries):
+        """
+        Split at once the productions of <entries>, a list of (production id,
+        quantity, unit id, count) where count is optional.
+        It is exposed to RPC so the integrations can split many productions in
+        a single call.
+        Return for each entry a dictionary with the new number of the
+        production, the ids and numbers of the new productions and the code of
+        the error if it can not be split:
+        - missing: the production does not exist
+        - duplicate: the production is in a previous entry
+        - state: the production is not in a state that can be split
+        - quantity: the production has no product or quantity
+        - invalid_quantity: the quantity to split into is not greater than 0
+        - unit: the unit does not exist or it is not of the category of the
+          production unit
+        - locked: another transaction holds the production or its moves
+        - not_split: the quantity leaves nothing to split, the production is
+          kept as it is
+        """
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        id2production = {p.id: p for p in cls.search([
+                    ('id', 'in', list({e[0] for e in entries})),
+                    ])}
+        id2unit = {u.id: u for u in Uom.search([
+                    ('id', 'in', list({e[2] for e in entries})),
+                    ])}
+        results, to_split, seen = [], [], set()
+        for entry in entries:
+            production_id, quantity, unit_id = entry[:3]
+            count = entry[3] if len(entry) > 3 else None
+            production = id2production.get(production_id)
+            unit = id2unit.get(unit_id)
+            error = None
+            if not production:
+                error = 'missing'
+            elif production in seen:
+                error = 'duplicate'
+            elif production.state not in {
+                    'request', 'draft', 'waiting', 'assigned'}:
+                error = 'state'
+            elif not production.product or not production.quantity:
+                error = 'quantity'
+            elif quantity is None or quantity <= 0:
+                error = 'invalid_quantity'
+            elif not unit or unit.category != production.unit.category:
+                error = 'unit'
+            else:
+                to_split.append((production, quantity, unit, count))
+            seen.add(production)
+            results.append((production if not error else None, error))
+
+        # A locked production only fails its own entry
+        busy = cls._split_try_lock([p for p, _, _, _ in to_split])
+        if busy:
+            to_split = [s for s in to_split if s[0] not in busy]
+            results = [(p, 'locked') if p in busy else (p, e)
+                for p, e in results]
+
+        # The new productions of each production precede it
+        production2children, children = {}, []
+        splitted = {p for p, _, _, _ in to_split}
+        for production in cls._split_each(to_split) if to_split else []:
+            if production in splitted:
+                production2children[production] = children
+                children = []
+            else:
+                children.append(production)
+
+        result = []
+        for production, error in results:
+            children = production2children.get(production, [])
+            if production and not error and not children:
+                error = 'not_split'
+            result.append({
+                    'number': production.number if production else None,
+                    'productions': [c.id for c in children],
+                    'numbers': [c.number for c in children],
+                    'error': error,
+                    })
+        return result
+
+    @classmethod
+    def _split_lock(cls, productions):
+        """
+        Lock the rows of <productions> and of their moves, and only them, so
+        they can not be modified until the split ends. It fails at once if
+        another transaction holds any of them instead of waiting for it.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        transaction = Transaction()
+
+        if not transaction.database.has_select_for():
+            return
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        move = Move.__table__()
+        for sub_productions in grouped_slice(productions):
+            sub_productions = list(sub_productions)
+            sub_ids = [p.id for p in sub_productions]
+            try:
+                cursor.execute(*table.select(Literal(1),
+                        where=reduce_ids(table.id, sub_ids),
+                        for_=For('UPDATE', nowait=True)))
+                cursor.execute(*move.select(Literal(1),
+                        where=(reduce_ids(move.production_input, sub_ids)
+                            | reduce_ids(move.production_output, sub_ids)),
+                        for_=For('UPDATE', nowait=True)))
+            except backend.DatabaseOperationalError:
+                raise UserError(gettext(
+                        'production_split_unexploded.production_locked',
+                        productions=', '.join(
+                            p.rec_name for p in sub_productions)))
+
+    @classmethod
+    def _split_try_lock(cls, productions):
+        """
+        Lock like _split_lock the rows of <productions> and of their moves
+        which are not held by another transaction, skipping the others instead
+        of failing.
+        Return the set of productions which could not be locked entirely.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        transaction = Transaction()
+
+        busy = set()
+        if not transaction.database.has_select_for():
+            return busy
+        For_ = transaction.database.get_select_for_skip_locked()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        move = Move.__table__()
+        for sub_productions in grouped_slice(productions):
+            sub_productions = list(sub_productions)
+            sub_ids = [p.id for p in sub_productions]
+            cursor.execute(*table.select(table.id,
+                    where=reduce_ids(table.id, sub_ids),
+                    for_=For_('UPDATE')))
+            locked = {i for i, in cursor}
+            where = (reduce_ids(move.production_input, sub_ids)
+                | reduce_ids(move.production_output, sub_ids))
+            cursor.execute(*move.select(move.id, where=where,
+                    for_=For_('UPDATE')))
+            locked_moves = {i for i, in cursor}
+            cursor.execute(*move.select(move.id,
+                    Coalesce(move.production_input, move.production_output),
+                    where=where))
+            for move_id, production_id in cursor:
+                if move_id not in locked_moves:
+                    locked.discard(production_id)
+            busy.update(p for p in sub_productions if p.id not in locked)
+        return busy
+
+    @classmethod
+    def _log_split(cls, plans, instrument, callback=None):
+        """
+        Create the production.split.log of the <plans> split with the
+        measures of <instrument>, log them and pass the log to <callback>.
+        """
+        pool = Pool()
+        SplitLog = pool.get('production.split.log')
+
+        plans = [(p, plan) for p, plan in plans if plan]
+        if not plans:
+            return
+        values = {
+            'production': plans[0][0].id if len(plans) == 1 else None,
+            'productions': len(plans),
+            'children': sum(plan['children'] for _, plan in plans),
+            'batch': Transaction().context.get('split_batch'),
+            }
+        for phase in instrument.phases:
+            values[phase + '_time'] = instrument.times[phase]
+            values[phase + '_queries'] = instrument.queries[phase]
+        # The log is kept whatever the access rights of the user splitting
+        with without_check_access():
+            log, = SplitLog.create([values])
+        logger.info('split %s productions into %s new ones: %s',
+            log.productions, log.children, ', '.join(
+                '%s %.3fs/%s queries' % (
+                    p, instrument.times[p], instrument.queries[p])
+                for p in instrument.phases))
+        if callback:
+            callback(log)
+
+    @classmethod
+    def _log_split_error(cls, production, exception):
+        "Create the production.split.log of a split which failed"
+        pool = Pool()
+        SplitLog = pool.get('production.split.log')
+        with without_check_access():
+            SplitLog.create([{
+                        'production': production.id,
+                        'productions': 1,
+                        'children': 0,
+                        'batch': Transaction().context.get('split_batch'),
+                        'error': exception.message,
+                        }])
+        logger.warning('split of production %s failed: %s',
+            production.id, exception.message)
+
+    def split_plan(self, quantity, unit, count=None):
+        """
+        Return how the production would be split into productions of quantity
+        without writing anything, or None if it would not be split.
+
+        The plan is a dictionary with:
+        - quantities: of each new production
+        - unit: of the new productions
+        - remainder: the quantity left in the current production
+        - children: the number of new productions
+        - numbers: the number of each new production and the current one
+          (last), None if the production has no number yet
+        - inputs and outputs: the moves planning (see _plan_split_moves)
+        """
+        plan = self._split_plan(quantity, unit, count)
+        if plan:
+            plan['numbers'] = self._split_numbers(plan['children'],
+                *self._split_number_bases([self])[self])
+        return plan
+
+    def _split_plan(self, quantity, unit, count=None):
+        '''
+        Return the plan of split_plan without the numbers, which are computed
+        for all the productions at once when the plans are applied.
+        '''
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        # Work with the number of rounding steps of the unit so the quantities
+        # of all the productions sum exactly the initial one
+        initial = Uom.compute_qty(self.unit, self.quantity, unit)
+        total = round(initial / unit.rounding)
+        steps = self._split_steps(total, self._split_quantity_steps(
+                quantity, unit), count)
+        if not steps:
             # Splitted to quantity greater than produciton's quantity
-            return [self]
-
-        factor = quantity / initial
-        input2qty = {}  # amount for each input in splitted productions
-        for input_ in self.inputs:
-            # Maybe someone want customize the key of the dictionary
-            input2qty.setdefault(self.split_key(input_), 0)
-            input2qty[self.split_key(input_)] += Uom.compute_qty(
-                input_.unit, input_.quantity * factor,
-                input_.product.default_uom,
-                round=False)
-        output2qty = {}  # amount for each output in splitted productions
-        for output in self.outputs:
-            # Maybe someone want customize the key of the dictionary
-            output2qty.setdefault(self.split_key(output), 0)
-            output2qty[self.split_key(output)] += Uom.compute_qty(
-                output.unit, output.quantity * factor,
-                output.product.default_uom,
-                round=False)
-
-        if not self.number:
-            Production.set_number([self])
-        number = self.number
-        state = self.state
-        suffix = 2
-        # The last "cut" is done after the loop
-        remainder -= quantity
-        if count:
-            count -= 1
-        productions = []
-        while ((remainder - quantity) >= unit.rounding  # remainder > quantity
-                and (count or count is None)):
-            productions.append(self._split_production(
-                    '%s-%02d' % (number, suffix), quantity, unit, input2qty,
-                    output2qty))
-            remainder -= quantity
-            if count:
-                count -= 1
-            suffix += 1
-
-        assert remainder > unit.rounding
-        # The initial production contains the remaining quantity
-        productions.append(self._split_production(
-                '%s-%02d' % (number, suffix), quantity, unit, input2qty,
-                output2qty))
-        self.write([self], {
-                'number': '%s-%02d' % (number, 1),
-                'quantity': unit.round(remainder),
-                'unit': unit.id,
-                'state': state,
-                })
-        self.write(productions, {'state': state})
-        productions.append(self)
-        return productions
+            return
 
-    def _split_production(self, number, quantity, unit, input2qty, output2qty):
-        production, = self.copy([self], {
-                'number': number,
-                'reference': self.reference,
-                'quantity': quantity,
-                'unit': unit.id,
-                'inputs': None,
-                'outputs': None,
-                })
-        self._split_moves(self.inputs, production, input2qty,
-            'production_input')
-        self._split_moves(self.outputs, production, output2qty,
-            'production_output')
-        return production
+        convert = UomConverter()
+        # All the moves are planned in a single pass whatever the quantity of
+        # each new production is
+        shares = [Fraction(s, total) for s in steps]
+        return {
+            'quantities': [unit.round(s * unit.rounding) for s in steps],
+            'unit': unit,
+            'remainder': unit.round((total - sum(steps)) * unit.rounding),
+            'children': len(steps),
+            'inputs': self._plan_split_moves(
+                self._split_snapshot(self._splittable_moves(self.inputs)),
+                shares, convert),
+            'outputs': self._plan_split_moves(
+                self._split_snapshot(self._splittable_moves(self.outputs)),
+                shares, convert),
+            }
+
+    @staticmethod
+    def _split_count(total, step, count=None):
+        """
+        Return the number of new productions of <step> to split <total> into,
+        both being a number of rounding steps, leaving at least one step in
+        the current production.
+        """
+        if step <= 0 or total <= step:
+            return 0
+        # The current production keeps the remainder or a full step
+        children = -(-total // step) - 1
+        if count is not None:
+            children = min(children, max(count, 1))
+        return children
+
+    @staticmethod
+    def _split_quantity_steps(quantity, unit):
+        "Return the rounding steps of unit of the quantity or list of them"
+        if isinstance(quantity, (list, tuple)):
+            return [round(q / unit.rounding) for q in quantity]
+        return round(quantity / unit.rounding)
+
+    @classmethod
+    def _split_steps(cls, total, steps, count=None):
+        """
+        Return the list of rounding steps of each new production to split
+        <total> into, <steps> being the steps of all of them or a list with
+        the steps of each one, leaving at least one step in the current
+        production.
+        """
+        if not isinstance(steps, list):
+            return [steps] * cls._split_count(total, steps, count)
+        if count is not None:
+            steps = steps[:max(count, 1)]
+        result = []
+        for step in steps:
+            if step <= 0 or total <= step:
+                break
+            result.append(step)
+            total -= step
+        return result
+
+    @staticmethod
+    def _split_write_args(move2values):
+        """
+        Return the arguments of write for <move2values>, the moves which get
+        the same values being grouped to write them at once.
+        """
+        values2moves = defaultdict(list)
+        for move, values in move2values.items():
+            values2moves[tuple(sorted(values.items()))].append(move)
+        to_write = []
+        for values, moves in values2moves.items():
+            to_write.extend((moves, dict(values)))
+        return to_write
+
+    @staticmethod
+    def _splittable_moves(moves):
+        "Return the moves which can be split, the done and cancelled stay"
+        return [m for m in moves if m.state not in {'done', 'cancelled'}]
 
-    def _split_moves(self, current_moves, new_production, product2qty,
-            relation_field):
+    def _split_snapshot(self, moves):
         """
-        Split <current_moves> getting the quantity per product specified in
-        <product2qty> and "moving" it to <new_productoin> and leaving in
-        current production <self> the remaining quantities.
+        Return a SplitMove for each of <moves> with all the values needed to
+        split them read at once, so the planning does not read them again.
         """
         pool = Pool()
         Move = pool.get('stock.move')
         Uom = pool.get('product.uom')
 
-        product2pending_qty = product2qty.copy()
-        to_draft, to_write, reset_state, new_moves = [], [], [], []
-        for move in current_moves:
-            pending_qty = Uom.compute_qty(
-                move.product.default_uom,
-                product2pending_qty[self.split_key(move)],
-                move.unit,
-                round=False)
-            if pending_qty < move.unit.rounding:
-                # Leave this input to current production
-                continue
+        fields_names = ['quantity', 'state', 'unit', 'product.default_uom']
+        if 'lot' in Move._fields:
+            fields_names.append('lot')
+        id2values = {v['id']: v for v in Move.read([m.id for m in moves],
+                fields_names)}
+        uom_ids = set()
+        for values in id2values.values():
+            uom_ids.add(values['unit'])
+            uom_ids.add(values['product.']['default_uom'])
+        # Browsing all the units together loads them in a single read
+        uoms = {u.id: u for u in Uom.browse(list(uom_ids))}
+        snapshot = []
+        # Maybe someone want customize the key of the dictionary
+        for move, key in zip(moves, self.split_keys(moves)):
+            values = id2values[move.id]
+            snapshot.append(SplitMove(
+                    move=move,
+                    key=key,
+                    product=values['product.']['id'],
+                    quantity=values['quantity'],
+                    state=values['state'],
+                    unit=uoms[values['unit']],
+                    default_uom=uoms[values['product.']['default_uom']],
+                    lot=values.get('lot'),
+                    ))
+        return snapshot
 
-            if (move.quantity - pending_qty) < move.unit.rounding:
-                # move.quantity <= pending_qty
-                # Move this input to new production
-                product2pending_qty[self.split_key(move)] -= Uom.compute_qty(
-                    move.unit, move.quantity, move.product.default_uom,
-                    round=False)
-                to_write.extend(
-                    ([move], {relation_field: new_production.id}))
-                new_moves.append(move)
-                continue
+    def _split_numbers(self, count, base=None, start=2):
+        """
+        Return the numbers of <count> new productions, numbered from <base> or
+        the number of the production starting at suffix <start>, followed by
+        the new number of the current production
+        """
+        base = base or self.number
+        if not base:
+            return [None] * (count + 1)
+        return (['%s-%02d' % (base, s) for s in range(start, start + count)]
+            + ['%s-%02d' % (base, 1)])
+
+    @classmethod
+    def _split_number_bases(cls, productions):
+        """
+        Return for each of <productions> the (base, start) to number its new
+        productions: a production already split keeps numbering its family
+        after the greatest suffix used. The productions split from all of them
+        are read with a single query on the split_origin index.
+        """
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        origin2numbers = defaultdict(list)
+        for sub_productions in grouped_slice(productions):
+            cursor.execute(*table.select(table.split_origin, table.number,
+                    where=reduce_ids(table.split_origin,
+                        [p.id for p in sub_productions])))
+            for origin, number in cursor:
+                origin2numbers[origin].append(number)
+
+        result = {}
+        for production in productions:
+            base = production.number
+            numbers = origin2numbers.get(production.id)
+            if base and numbers and base.endswith('-01'):
+                base = base[:-3]
+            suffixes = [1]
+            if base:
+                prefix = base + '-'
+                suffixes.extend(int(n[len(prefix):]) for n in numbers or []
+                    if n and n.startswith(prefix) and n[len(prefix):].isdigit())
+            result[production] = (base, max(suffixes) + 1)
+        return result
+
+    def iter_split(self, quantity, unit, count=None, chunk_size=None,
+            commit=False, callback=None):
+        """
+        Split the production like split does but creating the new productions
+        by chunks of <chunk_size>, or the size defined in the configuration,
+        and moving their part of the moves before planning the next chunk.
+        Yield for each chunk the list of new productions and the number of new
+        productions still pending.
+        If commit is set, the transaction is committed after each chunk so if
+        one fails, calling it again splits the quantity left where it stopped,
+        the new productions continuing the numbering of the previous ones and
+        <count> and <quantity> taking into account the productions created
+        before it stopped.
+        Each chunk gets its production.split.log like split_many does.
+        """
+        pool = Pool()
+        Configuration = pool.get('production.configuration')
+        transaction = Transaction()
+        cls = self.__class__
+
+        if not chunk_size:
+            chunk_size = Configuration(1).get_split_chunk_size()
+        # Resume the split where a previous run stopped
+        done = cls(self.id).split_done or 0
+        if done and isinstance(quantity, (list, tuple)):
+            quantity = quantity[done:]
+        while True:
+            # Reload the production to plan from the written quantities
+            production = cls(self.id)
+            size = chunk_size
+            if count is not None:
+                size = min(size, count - done)
+            if size <= 0:
+                break
+            instrument = SplitInstrument()
+            with instrument.counting():
+                with instrument.phase('planning'):
+                    cls._split_lock([production])
+                    plan = production._split_plan(quantity, unit, size)
+                if not plan:
+                    break
+                productions = cls._apply_split_plans(
+                    [(production, plan)], instrument)[:-1]
+            cls._log_split([(production, plan)], instrument, callback)
+            done += plan['children']
+            cls.write([production], {'split_done': done})
+            if isinstance(quantity, (list, tuple)):
+                # The next chunk goes on with the following quantities
+                quantity = quantity[plan['children']:]
+            if count is not None and done >= count:
+                pending = 0
+            else:
+                pending = len(self._split_steps(
+                        round(plan['remainder'] / unit.rounding),
+                        self._split_quantity_steps(quantity, unit),
+                        None if count is None else count - done))
+            yield productions, pending
+            if commit:
+                transaction.commit()
+        cls.write([cls(self.id)], {'split_done': None})
+
+    @classmethod
+    def split_chunked(cls, productions, quantity, unit, count=None,
+            commit=False):
+        """
+        Split each of <productions> with iter_split updating the split progress
+        of the production after each chunk.
+        It is the method run by the split in background.
+        If commit is set, the productions which can not be split get a
+        production.split.log with the error and the others are still split,
+        and on any other error the split state of the productions not split
+        yet is cleared before raising it.
+        """
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        transaction = Transaction()
 
-            # split move moving pending_qty to new production and leaving
-            # remaining to current one
-            product2pending_qty[self.split_key(move)] = 0
-            new_move_qty = move.unit.round(pending_qty)
-            new_move, = Move.copy([move], {
-                    relation_field: new_production.id,
-                    'quantity': new_move_qty,
-                    'state': 'draft',
+        if isinstance(unit, int):
+            unit = Uom(unit)
+        for i, production in enumerate(productions):
+            try:
+                cls.write([production], {'split_state': 'running'})
+                done = cls(production.id).split_done or 0
+                for children, pending in production.iter_split(
+                        quantity, unit, count, commit=commit):
+                    done += len(children)
+                    cls.write([production], {
+                            'split_progress': round(
+                                100 * done / (done + pending), 2),
+                            })
+            except UserError as exception:
+                if not commit:
+                    raise
+                transaction.rollback()
+                cls._log_split_error(production, exception)
+            except Exception:
+                if commit:
+                    transaction.rollback()
+                    cls.write([cls(p.id) for p in productions[i:]], {
+                            'split_state': None,
+                            'split_progress': None,
+                            })
+                    transaction.commit()
+                raise
+            cls.write([production], {
+                    'split_state': None,
+                    'split_progress': None,
                     })
-            new_moves.append(new_move)
-            to_write.extend(([move], {
-                    'quantity': move.unit.round(move.quantity - new_move_qty),
-                    }))
-            if move.state != 'draft':
-                to_draft.append(move)
-                reset_state.extend(
-                    ([move, new_move], {'state': move.state}))
-
-        # Reset to draft before the changes to avoid control over don't modify
-        # non-draft moves
-        if to_draft:
-            Move.write(to_draft, {'state': 'draft'})
+            if commit:
+                transaction.commit()
+
+    @classmethod
+    def split_parallel(cls, productions, quantity, unit, count=None):
+        """
+        Split <productions> in background by batches of the size defined in
+        the configuration. Each batch is a task of the queue, so the workers
+        split them in parallel, each one in its own transaction.
+        Return the identifier of the batch which is set on the
+        production.split.log of all of them, the errors included.
+        """
+        pool = Pool()
+        Configuration = pool.get('production.configuration')
+
+        size = Configuration(1).get_split_batch_size()
+        batch = str(uuid.uuid4())
+        cls.write(productions, {
+                'split_state': 'queued',
+                'split_progress': 0,
+                })
+        with Transaction().set_context(split_batch=batch):
+            for sub_productions in grouped_slice(productions, size):
+                cls.__queue__.split_chunked(list(sub_productions), quantity,
+                    unit.id, count, commit=True)
+        return batch
+
+    def rebalance(self, quantity, unit, count=None):
+        """
+        Split again the family of the production, <self> being the production
+        the others were split from, into productions of quantity like split
+        does but changing only what differs from the current family: the new
+        productions which already have the quantity are kept as they are, the
+        missing ones are created, the ones left over are removed and the moves
+        are only moved or cut from the productions with more quantity than
+        they need to the ones with less.
+        All the productions of the family must be in a state that can be
+        split.
+        Return the new productions followed by the production.
+        """
+        cls = self.__class__
+
+        children = list(self.split_children)
+        for production in [self] + children:
+            if production.state not in {
+                    'request', 'draft', 'waiting', 'assigned'}:
+                raise UserError(gettext(
+                        'production_split_unexploded.cannot_rebalance',
+                        production=production.rec_name,
+                        origin=self.rec_name))
+        if not children:
+            return self.split(quantity, unit, count)
+
+        convert = UomConverter()
+        family = children + [self]
+        cls._split_lock(family)
+        initial = sum(convert(p.unit, p.quantity, unit) for p in family)
+        total = round(initial / unit.rounding)
+        step = round(quantity / unit.rounding)
+        count = self._split_count(total, step, count)
+        quantity = unit.round(step * unit.rounding)
+        remainder = unit.round((total - count * step) * unit.rounding)
+
+        # The new productions which already have the quantity are kept first
+        children.sort(key=lambda c: (c.unit, c.quantity) != (unit, quantity))
+        kept, removed = children[:count], children[count:]
+        new = []
+        if len(kept) < count:
+            base, start = self._split_number_bases([self])[self]
+            numbers = self._split_numbers(count - len(kept), base, start)
+            new, = cls._split_productions(
+                [(self, numbers[:-1], [quantity] * len(numbers[:-1]), unit)])
+        productions = kept + new + [self]
+
+        shares = [Fraction(step, total)] * count
+        shares.append(1 - sum(shares))
+        production2index = {p: i for i, p in enumerate(productions)}
+        for field, relation_field in [
+                ('inputs', 'production_input'),
+                ('outputs', 'production_output'),
+                ]:
+            moves, owners = [], []
+            for production in family:
+                for move in getattr(production, field):
+                    if move.state not in {'done', 'cancelled'}:
+                        moves.append(move)
+                        owners.append(production2index.get(production))
+            plan = self._plan_rebalance_moves(
+                self._split_snapshot(moves), owners, shares, convert)
+            cls._apply_split_moves([(productions, plan)], relation_field)
+
+        to_write = []
+        resized = [c for c in kept
+            if (c.unit, c.quantity) != (unit, quantity)]
+        if resized:
+            to_write.extend((resized, {
+                        'quantity': quantity,
+                        'unit': unit.id,
+                        }))
+        if new:
+            to_write.extend((new, {'state': self.state}))
+        if (self.unit, self.quantity) != (unit, remainder):
+            to_write.extend(([self], {
+                        'quantity': remainder,
+                        'unit': unit.id,
+                        }))
+        if removed:
+            # The productions split from the removed ones are kept in the
+            # family
+            grandchildren = cls.search([
+                    ('split_origin', 'in', [c.id for c in removed]),
+                    ])
+            if grandchildren:
+                to_write.extend((grandchildren, {'split_origin': self.id}))
         if to_write:
+            cls.write(*to_write)
+        if removed:
+            # The removed productions have no moves left to cancel
+            cls.cancel(removed)
+            cls.delete(removed)
+        return kept + new + [self]
+
+    def _plan_rebalance_moves(self, current_moves, owners, shares,
+            convert=None):
+        """
+        Plan how to move the quantities of <current_moves>, a list of
+        SplitMove, each one belonging to the production at the index of
+        <owners> (None for the productions to remove), so each production gets
+        the share of the moves of each key specified in <shares>.
+
+        Only the productions with more quantity than their share give a part
+        of their moves to the productions with less, so the moves of balanced
+        productions are not changed.
+
+        Nothing is written, it returns the same tuple than _plan_split_moves.
+        """
+        if convert is None:
+            convert = UomConverter()
+
+        grouping = SplitIndex(current_moves, convert)
+        move2owner = dict(zip(current_moves, owners))
+
+        fragments, move2index, move2qty = [], {}, {}
+        for key in grouping.keys():
+            moves = [(m, move2owner[m]) for m in grouping.moves(key)]
+            quantities = grouping.quantities(key)
+            total = grouping.total(key)
+            owner2quantity = defaultdict(Fraction)
+            for (_, owner), quantity in zip(moves, quantities):
+                owner2quantity[owner] += quantity
+            # The removed productions give all their quantity
+            surplus = {None: owner2quantity[None]}
+            deficits = []
+            for index, share in enumerate(shares):
+                balance = total * share - owner2quantity[index]
+                if balance > 0:
+                    deficits.append([index, balance])
+                else:
+                    surplus[index] = -balance
+
+            for (move, owner), quantity in zip(moves, quantities):
+                move2qty[move] = move.quantity
+                give = min(quantity, surplus.get(owner, 0))
+                if not give or not deficits:
+                    continue
+                owner2part, given = {}, 0
+                while given < give and deficits:
+                    deficit = deficits[0]
+                    part = min(give - given, deficit[1])
+                    owner2part[deficit[0]] = (
+                        owner2part.get(deficit[0], 0) + part)
+                    given += part
+                    deficit[1] -= part
+                    if not deficit[1]:
+                        deficits.pop(0)
+                surplus[owner] -= given
+                if quantity > given:
+                    # What is left of a removed production goes to the
+                    # current one
+                    index = owner if owner is not None else len(shares) - 1
+                    owner2part[index] = (
+                        owner2part.get(index, 0) + quantity - given)
+                steps = round(move.quantity / move.unit.rounding)
+                owner2steps = dict(zip(owner2part, largest_remainder(
+                            steps, owner2part.values())))
+
+                # The move stays if its production keeps a part otherwise it
+                # is "moved" to the last production getting a part
+                target = (owner if owner2steps.get(owner)
+                    else max((o for o, s in owner2steps.items() if s),
+                        default=owner))
+                quantity = move.quantity
+                for index, steps in owner2steps.items():
+                    if index == target or not steps:
+                        continue
+                    new_move_qty = move.unit.round(steps * move.unit.rounding)
+                    fragments.append((move, index, new_move_qty))
+                    quantity -= new_move_qty
+                move2qty[move] = move.unit.round(quantity)
+                if target != owner:
+                    move2index[move] = target
+        return fragments, move2index, move2qty
+
+    @staticmethod
+    def _split_assigned_order(moves, quantities):
+        """
+        Return <moves> and their <quantities> with the assigned moves first,
+        so the new productions take their reservation.
+        """
+        order = sorted(range(len(moves)),
+            key=lambda i: moves[i].state != 'assigned')
+        return [moves[i] for i in order], [quantities[i] for i in order]
+
+    @staticmethod
+    def _split_lot_order(moves, quantities, shares):
+        """
+        Return <moves> and their <quantities> laid out so the parts of
+        <shares> take whole lots wherever possible: each new production takes
+        first the largest lots which fit in its part, then the moves without
+        lot and only when none of them is left a lot is cut.
+        """
+        total = sum(quantities)
+        lot2moves, free = {}, []
+        for move, quantity in zip(moves, quantities):
+            if move.lot:
+                lot2moves.setdefault(move.lot, []).append((move, quantity))
+            else:
+                free.append((move, quantity))
+        lots = [(sum(q for _, q in m), m) for m in lot2moves.values()]
+
+        result, need = [], Fraction(0)
+        for share in shares:
+            need += share * total
+            while need > 0 and (lots or free):
+                fitting = [l for l in lots if l[0] <= need]
+                if fitting:
+                    lot = max(fitting, key=lambda l: l[0])
+                elif free:
+                    move = free.pop(0)
+                    result.append(move)
+                    need -= move[1]
+                    continue
+                else:
+                    lot = lots[0]
+                lots.remove(lot)
+                result.extend(lot[1])
+                need -= lot[0]
+        for _, lot_moves in lots:
+            result.extend(lot_moves)
+        result.extend(free)
+        return [m for m, _ in result], [q for _, q in result]
+
+    @classmethod
+    def _apply_split_plans(cls, plans, instrument=None, links=None,
+            output_lots=False):
+        """
+        Split the productions as computed by _split_plan, <plans> being a list
+        of (production, plan) tuples. The plan may be None for productions that
+        must not be split. The phases are measured by the SplitInstrument
+        <instrument>.
+        The new productions of the upstream productions of <links>, as
+        computed by _plan_split_upstream, get as origin the fragments of the
+        input they supply.
+        If <output_lots> is set, the outputs of each new production get their
+        own lots, see _create_split_lots.
+        Return the splitted productions, each one followed by the production it
+        comes from.
+        """
+        if instrument is None:
+            instrument = SplitInstrument()
+        to_split = [(p, plan) for p, plan in plans if plan]
+        to_number = [p for p, _ in to_split if not p.number]
+        with instrument.phase('numbering'):
+            if to_number:
+                cls.set_number(to_number)
+            bases = cls._split_number_bases([p for p, _ in to_split])
+        production2state = {p: p.state for p, _ in to_split}
+        production2numbers = {
+            p: p._split_numbers(plan['children'], *bases[p])
+            for p, plan in to_split}
+
+        with instrument.phase('creation'):
+            children = cls._split_productions([
+                    (p, production2numbers[p][:-1], plan['quantities'],
+                        plan['unit'])
+                    for p, plan in to_split])
+        production2children = dict(zip((p for p, _ in to_split), children))
+        with instrument.phase('inputs'):
+            fragment2move = cls._apply_split_moves([
+                    (production2children[p], plan['inputs'])
+                    for p, plan in to_split], 'production_input')
+        with instrument.phase('outputs'):
+            output2move = cls._apply_split_moves([
+                    (production2children[p], plan['outputs'])
+                    for p, plan in to_split], 'production_output')
+            if output_lots:
+                child2outputs = defaultdict(list)
+                for (move, child), new_move in output2move.items():
+                    child2outputs[child].append((move, new_move))
+                for production, plan in to_split:
+                    _, move2index, _ = plan['outputs']
+                    for move, index in move2index.items():
+                        child = production2children[production][index]
+                        child2outputs[child].append((move, move.move))
+                cls._create_split_lots(child2outputs)
+
+        to_write = []
+        state2productions = defaultdict(list)
+        for production, plan in to_split:
+            state = production2state[production]
+            to_write.extend(([production], {
+                        'number': production2numbers[production][-1],
+                        'quantity': plan['remainder'],
+                        'unit': plan['unit'].id,
+                        'state': state,
+                        }))
+            state2productions[state].extend(production2children[production])
+        for state, productions in state2productions.items():
+            to_write.extend((productions, {'state': state}))
+        for supplier, move, production, indexes in links or []:
+            children = production2children[production]
+            for child, index in zip(production2children[supplier], indexes):
+                to_write.extend(([child], {
+                            'origin': str(fragment2move[
+                                    (move, children[index])]),
+                            }))
+        with instrument.phase('state'):
+            if to_write:
+                cls.write(*to_write)
+
+        result = []
+        for production, _ in plans:
+            result.extend(production2children.get(production, []))
+            result.append(production)
+        return result
+
+    @classmethod
+    def _create_split_lots(cls, child2outputs):
+        """
+        Create at once a lot for each new production and product of
+        <child2outputs>, a dictionary of the new productions and their list of
+        (SplitMove, output move), and set it to the output moves which had a
+        lot or require one. The lots are numbered as their production.
+        It does nothing if stock_lot is not activated.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        if 'lot' not in Move._fields:
+            return
+        Lot = pool.get('stock.lot')
+
+        key2moves = {}
+        for child, outputs in child2outputs.items():
+            for move, output in outputs:
+                if not move.lot and not output.product.lot_is_required(
+                        output.from_location, output.to_location):
+                    continue
+                key2moves.setdefault(
+                    (child, output.product), []).append(output)
+        if not key2moves:
+            return
+        lots = Lot.create([{
+                    'number': c.number,
+                    'product': p.id,
+                    } for c, p in key2moves])
+        to_write = []
+        for moves, lot in zip(key2moves.values(), lots):
+            to_write.extend((moves, {'lot': lot.id}))
+        with Transaction().set_context(_production_split=True):
             Move.write(*to_write)
-        if reset_state:
-            Move.write(*reset_state)
+
+    @classmethod
+    def _split_productions(cls, to_split):
+        """
+        Create the new productions, without moves, for all the (production,
+        numbers, quantities, unit) of <to_split> at once, quantities being the
+        quantity of each new production.
+        Return the list of new productions for each one.
+        """
+        to_copy, numbers, quantities, units = [], [], [], []
+        for production, numbers_, quantities_, unit in to_split:
+            to_copy.extend([production] * len(numbers_))
+            numbers.extend(numbers_)
+            quantities.extend(quantities_)
+            units.extend([unit.id] * len(numbers_))
+        # All the copies are created by a single create call, the iterators
+        # give each of them its own values in the same order
+        numbers, quantities, units = map(iter, (numbers, quantities, units))
+        with Transaction().set_context(_production_split=True):
+            productions = cls.copy(to_copy, {
+                    'split_origin': lambda data: data['id'],
+                    'number': lambda data: next(numbers),
+                    'reference': lambda data: data['reference'],
+                    # The new productions are assigned like the current one
+                    'assigned_by': lambda data: data['assigned_by'],
+                    'quantity': lambda data: next(quantities),
+                    'unit': lambda data: next(units),
+                    'inputs': None,
+                    'outputs': None,
+                    })
+        result = []
+        for _, numbers_, _, _ in to_split:
+            result.append(productions[:len(numbers_)])
+            del productions[:len(numbers_)]
+        return result
+
+    def _plan_split_moves(self, current_moves, shares, convert=None):
+        """
+        Plan how to split <current_moves>, a list of SplitMove, between new
+        productions, each of them getting the share of the moves of each key
+        specified in <shares>, leaving in current production <self> the
+        remaining quantities. The quantities are converted with the
+        UomConverter <convert>.
+
+        The moves of each key are laid one after the other, the new productions
+        take consecutive parts of them and the current production the last
+        one. When the moves have lots, they are laid by _split_lot_order to
+        keep the lots whole wherever possible, and the assigned moves are laid
+        first when _split_assigned_first is in the context. The moves of each part are
+        found on the SplitIndex by their cumulative quantity. The part of each
+        move is computed exactly in rounding steps of its unit and distributed
+        with the largest remainder method, so the fragments always sum the
+        quantity of the move.
+
+        Nothing is written, it returns a tuple with:
+        - the list of (move, index, quantity) fragments to cut from a move and
+          move to the new production at index
+        - a dictionary of the moves "moved" entirely to the new production at
+          index
+        - a dictionary with the quantity that will remain in each move
+        """
+        if convert is None:
+            convert = UomConverter()
+
+        # Bounds of the part of each new production, the current one (None)
+        # gets the last part
+        bounds = [Fraction(0)] + list(accumulate(shares))
+        owners = list(range(len(shares))) + [None]
+        bounds.append(Fraction(1))
+
+        grouping = SplitIndex(current_moves, convert)
+        fragments, move2index, move2qty = [], {}, {}
+        for key in grouping.keys():
+            if any(m.lot for m in grouping.moves(key)):
+                grouping.reorder(key, *self._split_lot_order(
+                        grouping.moves(key), grouping.quantities(key), shares))
+            if Transaction().context.get('_split_assigned_first'):
+                grouping.reorder(key, *self._split_assigned_order(
+                        grouping.moves(key), grouping.quantities(key)))
+            moves, total = grouping.moves(key), grouping.total(key)
+            move2qty.update((m, m.quantity) for m in moves)
+            if not total:
+                # Leave the moves to current production
+                continue
+            # The moves at the bounds are cut, the ones between two bounds
+            # are moved entirely to the same production
+            move2owner2part = defaultdict(dict)
+            start = Fraction(0)
+            for i, owner in enumerate(owners):
+                end = bounds[i + 1] * total
+                if end <= start:
+                    continue
+                first, last = grouping.find(key, start), grouping.find(key, end)
+                for j in range(first, last + 1):
+                    move_start, move_end = grouping.span(key, j)
+                    part = min(end, move_end) - max(start, move_start)
+                    if part > 0:
+                        move2owner2part[j][owner] = part
+                start = end
+
+            for j, move in enumerate(moves):
+                owner2part = move2owner2part.get(j)
+                if not owner2part:
+                    # Leave this move to current production
+                    continue
+                steps = round(move.quantity / move.unit.rounding)
+                owner2steps = dict(zip(owner2part, largest_remainder(
+                            steps, owner2part.values())))
+
+                if not any(owner2steps.values()):
+                    # Less than a rounding step, it can not be cut
+                    continue
+
+                # The current production keeps the move if it has a part
+                # otherwise it is "moved" to the last new production
+                owner = (None if owner2steps.get(None)
+                    else max(o for o, s in owner2steps.items() if s))
+                quantity = move.quantity
+                for index, steps in owner2steps.items():
+                    if index == owner or not steps:
+                        continue
+                    new_move_qty = move.unit.round(steps * move.unit.rounding)
+                    fragments.append((move, index, new_move_qty))
+                    quantity -= new_move_qty
+                move2qty[move] = move.unit.round(quantity)
+                if owner is not None:
+                    move2index[move] = owner
+        return fragments, move2index, move2qty
+
+    @classmethod
+    def _apply_split_moves(cls, plans, relation_field):
+        """
+        Write the move plans computed by _plan_split_moves, <plans> being a
+        list of (productions, plan) tuples where each index of the plan refers
+        to the new production in productions.
+
+        The fragments keep the state, locations and lot of the move they come
+        from, so the reservation of assigned moves is divided between the
+        productions without assigning them again.
+        Return a dictionary with the new move of each (move, production)
+        fragment.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+
+        fragments, move2index, move2qty = [], {}, {}
+        for productions, (fragments_, move2index_, move2qty_) in plans:
+            fragments.extend((m, productions[i], q) for m, i, q in fragments_)
+            move2index.update(
+                (m, productions[i]) for m, i in move2index_.items())
+            move2qty.update(move2qty_)
+
+        # All the fragments are created by a single create call, the iterators
+        # give each of them its own production and quantity in the same order
+        targets = iter([p.id for _, p, _ in fragments])
+        quantities = iter([q for _, _, q in fragments])
+        new_moves = Move.copy([m.move for m, _, _ in fragments], {
+                relation_field: lambda data: next(targets),
+                'quantity': lambda data: next(quantities),
+                'state': 'draft',
+                })
+
+        move2values = {}
+        for move, production in move2index.items():
+            move2values.setdefault(move.move, {})[relation_field] = (
+                production.id)
+        for move, quantity in move2qty.items():
+            if quantity != move.quantity:
+                move2values.setdefault(move.move, {})['quantity'] = quantity
+        # The fragments are created as draft so they get the state of the
+        # move they come from
+        for (move, _, _), new_move in zip(fragments, new_moves):
+            if move.state != 'draft':
+                move2values[new_move] = {'state': move.state}
+
+        to_write = cls._split_write_args(move2values)
+        if to_write:
+            # Resize the moves keeping their state
+            with Transaction().set_context(_production_split=True):
+                Move.write(*to_write)
+        return {(m, p): n for (m, p, _), n in zip(fragments, new_moves)}
+
+    @classmethod
+    def merge(cls, productions):
+        """
+        Merge back into each of <productions> the productions split from it,
+        undoing the split: the moves of the same split key, product, unit,
+        state, lot and locations are folded into a single move of the
+        production and the merged productions are deleted.
+        <productions> and the productions split from them must be in a state
+        that can be split.
+        Return the merged productions.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+
+        for production in productions:
+            if production.state not in {
+                    'request', 'draft', 'waiting', 'assigned'}:
+                raise UserError(gettext(
+                        'production_split_unexploded.cannot_merge',
+                        production=production.rec_name,
+                        origin=production.rec_name))
+        children = cls.search([
+                ('split_origin', 'in', [p.id for p in productions]),
+                ])
+        if not children:
+            return productions
+        cls._split_lock(list(productions) + children)
+        origin2children = defaultdict(list)
+        for child in children:
+            if child.state not in {'request', 'draft', 'waiting', 'assigned'}:
+                raise UserError(gettext(
+                        'production_split_unexploded.cannot_merge',
+                        production=child.rec_name,
+                        origin=child.split_origin.rec_name))
+            origin2children[child.split_origin].append(child)
+
+        to_write, to_delete = [], []
+        for field, relation_field in [
+                ('inputs', 'production_input'),
+                ('outputs', 'production_output'),
+                ]:
+            to_write_, to_delete_ = cls._merge_moves(
+                origin2children, field, relation_field)
+            to_write.extend(to_write_)
+            to_delete.extend(to_delete_)
+        # Fold the moves keeping their state, the reservation of the deleted
+        # assigned moves is kept by the move they are folded into
+        with Transaction().set_context(_production_split=True):
+            if to_write:
+                Move.write(*to_write)
+            if to_delete:
+                Move.delete(to_delete)
+
+        # The productions split from the merged ones are kept in the family
+        grandchildren = cls.search([
+                ('split_origin', 'in', [c.id for c in children]),
+                ])
+        convert = UomConverter()
+        to_write = []
+        for production, children_ in origin2children.items():
+            values = {
+                'quantity': production.unit.round(production.quantity + sum(
+                        convert(c.unit, c.quantity, production.unit)
+                        for c in children_)),
+                }
+            if production.number and production.number.endswith('-01'):
+                values['number'] = production.number[:-3]
+            to_write.extend(([production], values))
+            origin_grandchildren = [g for g in grandchildren
+                if g.split_origin in children_]
+            if origin_grandchildren:
+                to_write.extend((origin_grandchildren, {
+                            'split_origin': production.id,
+                            }))
+        # The merged productions have no moves left to cancel
+        cls.cancel(children)
+        cls.delete(children)
+        cls.write(*to_write)
+        return productions
+
+    @classmethod
+    def _merge_moves(cls, origin2children, field, relation_field):
+        """
+        Plan the folding of the moves of <field> of the children of
+        <origin2children> into the moves of the production they come from.
+        Return the arguments to write and the moves to delete.
+        """
+        move2values, to_delete = {}, []
+        for production, children in origin2children.items():
+            key2move, key2quantity = {}, defaultdict(float)
+            # The moves of the production come first so they are the kept ones
+            records = [production] + children
+            moves = [m for r in records for m in getattr(r, field)]
+            move2key = dict(zip(moves, production.split_keys(moves)))
+            for record in records:
+                for move in getattr(record, field):
+                    if move.state not in {'staging', 'draft', 'assigned'}:
+                        # Deleted with the merged production
+                        continue
+                    lot = getattr(move, 'lot', None)
+                    key = (move2key[move], move.product.id,
+                        move.unit.id, move.state, lot.id if lot else None,
+                        move.from_location.id, move.to_location.id)
+                    key2quantity[key] += move.quantity
+                    if key not in key2move:
+                        key2move[key] = move
+                        if record != production:
+                            move2values[move] = {
+                                relation_field: production.id,
+                                }
+                    else:
+                        to_delete.append(move)
+            for key, move in key2move.items():
+                quantity = move.unit.round(key2quantity[key])
+                if quantity != move.quantity:
+                    move2values.setdefault(move, {})['quantity'] = quantity
+
+        to_write = cls._split_write_args(move2values)
+        return to_write, to_delete
+
+
+class SplitLog(ModelSQL, ModelView):
+    'Production Split Log'
+    __name__ = 'production.split.log'
+    production = fields.Many2One('production', 'Production', readonly=True,
+        ondelete='SET NULL',
+        help='The production split when only one is split.')
+    productions = fields.Integer('Productions', readonly=True,
+        help='The number of productions split.')
+    children = fields.Integer('New Productions', readonly=True)
+    planning_time = fields.Float('Planning Time', readonly=True)
+    planning_queries = fields.Integer('Planning Queries', readonly=True)
+    numbering_time = fields.Float('Numbering Time', readonly=True)
+    numbering_queries = fields.Integer('Numbering Queries', readonly=True)
+    creation_time = fields.Float('Creation Time', readonly=True)
+    creation_queries = fields.Integer('Creation Queries', readonly=True)
+    inputs_time = fields.Float('Inputs Time', readonly=True)
+    inputs_queries = fields.Integer('Inputs Queries', readonly=True)
+    outputs_time = fields.Float('Outputs Time', readonly=True)
+    outputs_queries = fields.Integer('Outputs Queries', readonly=True)
+    state_time = fields.Float('State Time', readonly=True)
+    state_queries = fields.Integer('State Queries', readonly=True)
+    total_time = fields.Function(fields.Float('Total Time'), 'get_total')
+    total_queries = fields.Function(fields.Integer('Total Queries'),
+        'get_total')
+    batch = fields.Char('Batch', readonly=True,
+        help='The identifier shared by the productions split in parallel.')
+    error = fields.Text('Error', readonly=True,
+        help='The reason why the production could not be split.')
+
+    @classmethod
+    def __setup__(cls):
+        super(SplitLog, cls).__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+
+    def get_total(self, name):
+        suffix = name[len('total'):]
+        return sum(getattr(self, p + suffix) or 0
+            for p in SplitInstrument.phases)
+
+
+class SplitRule(sequence_ordered(), MatchMixin, ModelSQL, ModelView):
+    'Production Split Rule'
+    __name__ = 'production.split.rule'
+    product = fields.Many2One('product.product', 'Product',
+        ondelete='CASCADE',
+        domain=[
+            ('producible', '=', True),
+            ])
+    bom = fields.Many2One('production.bom', 'BOM', ondelete='CASCADE',
+        domain=[
+            If(Eval('product'),
+                ('output_products', '=', Eval('product', -1)),
+                ()),
+            ])
+    warehouse = fields.Many2One('stock.location', 'Warehouse',
+        ondelete='CASCADE',
+        domain=[
+            ('type', '=', 'warehouse'),
+            ])
+    quantity = fields.Float('Quantity', required=True, digits='unit',
+        domain=[
+            ('quantity', '>', 0),
+            ],
+        help='Maximum quantity of the productions.')
+    unit = fields.Many2One('product.uom', 'Unit', required=True)
+    count = fields.Integer('Count',
+        domain=['OR',
+            ('count', '=', None),
+            ('count', '>', 0),
+            ],
+        help='Maximum number of productions to create.')
 
 
 class SplitProductionStart(ModelView):
     'Split Production'
     __name__ = 'production.split.start'
+    mode = fields.Selection([
+            ('quantity', 'Quantity'),
+            ('quantities', 'Quantities'),
+            ('parts', 'Equal Parts'),
+            ('available', 'Available'),
+            ], 'Mode', required=True,
+        help='Quantity: productions of the same quantity.\n'
+        'Quantities: productions of each of the quantities.\n'
+        'Equal Parts: the number of productions of equal quantity.\n'
+        'Available: a production of the quantity that can be produced with '
+        'the stock available.')
     count = fields.Integer('Count', help='Maximum number of productions to'
-        ' create')
-    quantity = fields.Float('Quantity', required=True, digits='uom')
-    uom = fields.Many2One('product.uom', 'Uom', required=True,
+        ' create',
+        states={
+            'invisible': Eval('mode').in_(['parts', 'available']),
+            })
+    quantity = fields.Float('Quantity', digits='uom',
+        states={
+            'required': Eval('mode') == 'quantity',
+            'invisible': Eval('mode') != 'quantity',
+            })
+    quantities = fields.Char('Quantities',
+        states={
+            'required': Eval('mode') == 'quantities',
+            'invisible': Eval('mode') != 'quantities',
+            },
+        help='The quantity of each production separated by commas.')
+    parts = fields.Integer('Parts',
+        domain=['OR',
+            ('parts', '=', None),
+            ('parts', '>', 1),
+            ],
+        states={
+            'required': Eval('mode') == 'parts',
+            'invisible': Eval('mode') != 'parts',
+            })
+    uom = fields.Many2One('product.uom', 'Uom',
         domain=[
             ('category', '=', Eval('uom_category')),
-            ])
+            ],
+        states={
+            'required': Eval('mode') != 'available',
+            'invisible': Eval('mode') == 'available',
+            })
     uom_category = fields.Many2One('product.uom.category', 'Uom Category',
         readonly=True)
+    background = fields.Boolean('Background',
+        states={
+            'invisible': Eval('cascade', False) | Eval('output_lots', False),
+            },
+        help='Split the productions in a background task, creating the new '
+        'productions by chunks.')
+    cascade = fields.Boolean('Cascade',
+        help='Split also the productions which supply the inputs in the same '
+        'proportion.')
+    output_lots = fields.Boolean('Output Lots',
+        states={
+            'invisible': ~Eval('lots_allowed', False),
+            },
+        help='Create a lot for the outputs of each new production.')
+    lots_allowed = fields.Boolean('Lots Allowed', readonly=True)
+
+    @staticmethod
+    def default_mode():
+        return 'quantity'
+
+    def get_splits(self, productions):
+        "Return the (production, quantity, unit, count) to split productions"
+        pool = Pool()
+        Production = pool.get('production')
+        if self.mode == 'available':
+            return [(p, [q] if q else [], p.unit, 1)
+                for p, q in zip(productions,
+                    Production._split_available_quantities(productions))]
+        elif self.mode == 'parts':
+            return [(p, p._split_parts_quantities(self.parts, self.uom),
+                    self.uom, None) for p in productions]
+        elif self.mode == 'quantities':
+            try:
+                quantity = [float(q) for q in self.quantities.split(',')]
+            except ValueError:
+                raise UserError(gettext(
+                        'production_split_unexploded.invalid_quantities',
+                        quantities=self.quantities))
+        else:
+            quantity = self.quantity
+        return [(p, quantity, self.uom, self.count) for p in productions]
+
+
+class SplitProductionPreview(ModelView):
+    'Split Production Preview'
+    __name__ = 'production.split.preview'
+    productions = fields.One2Many('production.split.preview.production', None,
+        'Productions', readonly=True)
+    moves = fields.One2Many('production.split.preview.move', None, 'Moves',
+        readonly=True)
+
+
+class SplitProductionPreviewProduction(ModelView):
+    'Split Production Preview Production'
+    __name__ = 'production.split.preview.production'
+    number = fields.Char('Number', readonly=True)
+    quantity = fields.Float('Quantity', digits='unit', readonly=True)
+    unit = fields.Many2One('product.uom', 'Unit', readonly=True)
+
+
+class SplitProductionPreviewMove(ModelView):
+    'Split Production Preview Move'
+    __name__ = 'production.split.preview.move'
+    number = fields.Char('Number', readonly=True)
+    type = fields.Selection([
+            ('input', 'Input'),
+            ('output', 'Output'),
+            ], 'Type', readonly=True)
+    product = fields.Many2One('product.product', 'Product', readonly=True)
+    quantity = fields.Float('Quantity', digits='unit', readonly=True)
+    unit = fields.Many2One('product.uom', 'Unit', readonly=True)
+    action = fields.Selection([
+            ('keep', 'Kept'),
+            ('move', 'Moved'),
+            ('cut', 'Cut'),
+            ], 'Action', readonly=True,
+        help='Kept: the move remains in the current production.\n'
+        'Moved: the whole move is moved to the new production.\n'
+        'Cut: a part of the move is moved to the new production.')
 
 
 class SplitProduction(Wizard):
@@ -202,6 +2010,13 @@ class SplitProduction(Wizard):
     start = StateView('production.split.start',
         'production_split_unexploded.split_start_view_form', [
             Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Preview', 'preview', 'tryton-forward'),
+            Button('Split', 'split', 'tryton-ok', default=True),
+            ])
+    preview = StateView('production.split.preview',
+        'production_split_unexploded.split_preview_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Back', 'start', 'tryton-back'),
             Button('Split', 'split', 'tryton-ok', default=True),
             ])
     split = StateTransition()
@@ -209,19 +2024,123 @@ class SplitProduction(Wizard):
     def default_start(self, fields):
         pool = Pool()
         Production = pool.get('production')
+        Move = pool.get('stock.move')
         default = {}
-        production = Production(Transaction().context['active_id'])
-        if not production.product or not production.quantity:
-            raise UserError(gettext('production_split_unexploded.no_product_nor_quantity',
-                production=production.rec_name))
-        if production.unit:
-            default['uom'] = production.unit.id
-            default['uom_category'] = production.unit.category.id
+        productions = Production.browse(Transaction().context['active_ids'])
+        for production in productions:
+            if not production.product or not production.quantity:
+                raise UserError(gettext(
+                        'production_split_unexploded.no_product_nor_quantity',
+                        production=production.rec_name))
+        categories = {p.unit.category for p in productions if p.unit}
+        if len(categories) > 1:
+            raise UserError(gettext(
+                    'production_split_unexploded.different_uom_category'))
+        units = [p.unit for p in productions if p.unit]
+        if units:
+            default['uom'] = units[0].id
+            default['uom_category'] = units[0].category.id
+        default['lots_allowed'] = 'lot' in Move._fields
+        if hasattr(self.start, 'mode'):
+            default['mode'] = self.start.mode
+            default['quantity'] = self.start.quantity
+            default['quantities'] = self.start.quantities
+            default['parts'] = self.start.parts
+            default['count'] = self.start.count
+            if self.start.uom:
+                default['uom'] = self.start.uom.id
+            default['background'] = self.start.background
+            default['cascade'] = self.start.cascade
+            default['output_lots'] = self.start.output_lots
         return default
 
+    def default_preview(self, fields):
+        pool = Pool()
+        Production = pool.get('production')
+        productions, moves = [], []
+        for production, quantity, unit, count in self.start.get_splits(
+                Production.browse(Transaction().context['active_ids'])):
+            with Transaction().set_context(
+                    _split_assigned_first=self.start.mode == 'available'):
+                plan = production.split_plan(quantity, unit, count)
+            if not plan:
+                productions.append({
+                        'number': production.rec_name,
+                        'quantity': production.quantity,
+                        'unit': production.unit.id,
+                        })
+                continue
+            numbers = plan['numbers']
+            if not production.number:
+                # Show the suffix the numbers will have
+                suffixes = list(range(2, len(numbers) + 1)) + [1]
+                numbers = ['%s-%02d' % (production.rec_name, s)
+                    for s in suffixes]
+            productions.extend({
+                    'number': n,
+                    'quantity': q,
+                    'unit': plan['unit'].id,
+                    } for n, q in zip(numbers, plan['quantities']))
+            productions.append({
+                    'number': numbers[-1],
+                    'quantity': plan['remainder'],
+                    'unit': plan['unit'].id,
+                    })
+            for type_ in ['input', 'output']:
+                fragments, move2index, move2qty = plan[type_ + 's']
+                for move, index, quantity in fragments:
+                    moves.append(self._preview_move(
+                            numbers[index], type_, move, quantity, 'cut'))
+                for move, index in move2index.items():
+                    moves.append(self._preview_move(
+                            numbers[index], type_, move, move2qty[move],
+                            'move'))
+                for move, quantity in move2qty.items():
+                    if move not in move2index:
+                        moves.append(self._preview_move(
+                                numbers[-1], type_, move, quantity, 'keep'))
+        moves.sort(key=lambda m: (m['number'], m['type']))
+        return {
+            'productions': productions,
+            'moves': moves,
+            }
+
+    @staticmethod
+    def _preview_move(number, type_, move, quantity, action):
+        return {
+            'number': number,
+            'type': type_,
+            'product': move.product,
+            'quantity': quantity,
+            'unit': move.unit.id,
+            'action': action,
+            }
+
     def transition_split(self):
         pool = Pool()
         Production = pool.get('production')
-        production = Production(Transaction().context['active_id'])
-        production.split(self.start.quantity, self.start.uom, self.start.count)
+        splits = self.start.get_splits(
+            Production.browse(Transaction().context['active_ids']))
+        # The new productions take the reservation of the assigned moves when
+        # they are split to the stock available
+        with Transaction().set_context(
+                _split_assigned_first=self.start.mode == 'available'):
+            if (self.start.background and not self.start.cascade
+                    and not self.start.output_lots):
+                # The productions split into the same quantities share a batch
+                split2productions = defaultdict(list)
+                for production, quantity, unit, count in splits:
+                    if isinstance(quantity, list):
+                        quantity = tuple(quantity)
+                    split2productions[(quantity, unit, count)].append(
+                        production)
+                for (quantity, unit, count), productions in (
+                        split2productions.items()):
+                    if isinstance(quantity, tuple):
+                        quantity = list(quantity)
+                    Production.split_parallel(
+                        productions, quantity, unit, count)
+            else:
+                Production._split_each(splits, cascade=self.start.cascade,
+                    output_lots=self.start.output_lots)
         return 'end'
@@ -0,0 +1,34 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+from trytond.pool import PoolMeta
+from trytond.transaction import Transaction
+
+__all__ = ['Move']
+
+
+class Move(metaclass=PoolMeta):
+    __name__ = 'stock.move'
+
+    @classmethod
+    def check_modification(cls, mode, moves, values=None, external=False):
+        if (mode == 'write'
+                and Transaction().context.get('_production_split')
+                and 'quantity' in values):
+            # A split only resizes the moves between the production and its
+            # new productions, so assigned moves keep their state without
+            # checking their quantity while the other moves are fully checked
+            assigned = [m for m in moves if m.state == 'assigned']
+            if assigned:
+                cls.check_period_closed(assigned)
+                assigned_values = values.copy()
+                del assigned_values['quantity']
+                super(Move, cls).check_modification(
+                    mode, assigned, values=assigned_values, external=external)
+            moves = [m for m in moves if m.state != 'assigned']
+        elif (mode == 'delete'
+                and Transaction().context.get('_production_split')):
+            # A merge deletes the assigned moves folded into another move
+            # which keeps their reservation
+            moves = [m for m in moves if m.state != 'assigned']
+        super(Move, cls).check_modification(
+            mode, moves, values=values, external=external)
@@ -0,0 +1,186 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+import sys
+import time
+import tracemalloc
+import unittest
+from contextlib import contextmanager
+from decimal import Decimal
+
+from trytond.tests.test_tryton import activate_module, with_transaction
+from trytond.pool import Pool
+
+from trytond.modules.company.tests import create_company, set_company
+from trytond.modules.production_split_unexploded.production import (
+    SplitInstrument)
+
+# Set SPLIT_BENCHMARK to run the full grid of scenarios and print a report
+FULL = bool(os.environ.get('SPLIT_BENCHMARK'))
+
+# (products, moves per product, new productions)
+SCENARIOS = [
+    (1, 1, 10),
+    (1, 1, 100),
+    (10, 2, 10),
+    (10, 2, 30),
+    ]
+if FULL:
+    SCENARIOS = [(p, d, c)
+        for p in [1, 50, 500]
+        for d in [1, 3]
+        for c in [10, 500, 5000]]
+
+# Maximum number of queries of a split, it grows only with the records to
+# create or write. The base is the fixed cost measured on SQLite (about 220
+# queries) and each new production and fragment cost at most 3.5 and 1.8
+# queries, so the budget holds for any number of new productions
+QUERY_BUDGET = {
+    'base': 250,
+    'production': 4,
+    'fragment': 2,
+    }
+
+PHASES = SplitInstrument.phases
+
+
+class Metrics(object):
+    'Wall time, peak memory and split log of the split'
+
+    def __init__(self):
+        self.time = 0
+        self.peak = 0
+        self.log = None
+
+    @contextmanager
+    def record(self):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time = time.perf_counter() - start
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def callback(self, log):
+        self.log = log
+
+
+class ProductionSplitBenchmarkTestCase(unittest.TestCase):
+    'Benchmark ProductionSplit module'
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('production_split_unexploded')
+        cls.report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        if FULL:
+            sys.stderr.write('\n%8s %6s %8s %10s %8s %10s  %s\n' % (
+                    'products', 'moves', 'children', 'time', 'queries',
+                    'peak (kB)', 'phases (time/queries)'))
+            for scenario, metrics in cls.report:
+                log = metrics.log
+                sys.stderr.write('%8s %6s %8s %10.3f %8s %10d  %s\n' % (
+                        scenario + (metrics.time, log.total_queries,
+                            metrics.peak // 1024,
+                            ', '.join('%s: %.3f/%s' % (
+                                    n, getattr(log, n + '_time'),
+                                    getattr(log, n + '_queries'))
+                                for n in PHASES))))
+
+    def create_production(self, products, duplicates, children):
+        company = create_company()
+        with set_company(company):
+            return self._create_production(
+                company, products, duplicates, children)
+
+    def _create_production(self, company, products, duplicates, children):
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Production = pool.get('production')
+        Location = pool.get('stock.location')
+
+        storage, = Location.search([('code', '=', 'STO')])
+        production_loc, = Location.search([('code', '=', 'PROD')])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        warehouse.production_location = production_loc
+        warehouse.save()
+        unit, = Uom.search([('name', '=', 'Unit')])
+
+        templates = Template.create([{
+                    'name': 'Product %s' % i,
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    'list_price': Decimal(5),
+                    'producible': not i,
+                    } for i in range(products + 1)])
+        product, *components = Product.create([{
+                    'template': t.id,
+                    'cost_price': Decimal(1),
+                    } for t in templates])
+
+        quantity = children + 1
+        move = {
+            'unit': unit.id,
+            'company': company.id,
+            }
+        production, = Production.create([{
+                    'product': product.id,
+                    'unit': unit.id,
+                    'quantity': quantity,
+                    'warehouse': warehouse.id,
+                    'location': production_loc.id,
+                    'company': company.id,
+                    'inputs': [('create', [dict(move,
+                                    product=c.id,
+                                    quantity=quantity * (i + 1),
+                                    from_location=storage.id,
+                                    to_location=production_loc.id)
+                                for c in components
+                                for i in range(duplicates)])],
+                    'outputs': [('create', [dict(move,
+                                    product=product.id,
+                                    quantity=quantity,
+                                    from_location=production_loc.id,
+                                    to_location=storage.id,
+                                    currency=company.currency.id,
+                                    unit_price=Decimal(1))])],
+                    }])
+        return company, production, unit
+
+    def run_scenario(self, products, duplicates, children):
+        pool = Pool()
+        Production = pool.get('production')
+
+        company, production, unit = self.create_production(
+            products, duplicates, children)
+        moves = len(production.inputs) + len(production.outputs)
+        metrics = Metrics()
+        with set_company(company):
+            with metrics.record():
+                productions = Production.split_many([production], 1, unit,
+                    callback=metrics.callback)
+        self.report.append(((products, duplicates, children), metrics))
+
+        self.assertEqual(len(productions), children + 1)
+        self.assertEqual(sum(p.quantity for p in productions), children + 1)
+        # The queries are not counted on all the backends
+        if metrics.log.total_queries:
+            fragments = children * moves
+            budget = (QUERY_BUDGET['base']
+                + QUERY_BUDGET['production'] * children
+                + QUERY_BUDGET['fragment'] * fragments)
+            self.assertLessEqual(metrics.log.total_queries, budget)
+        return metrics
+
+    def test_split(self):
+        'Benchmark split'
+        for scenario in SCENARIOS:
+            with self.subTest(scenario=scenario):
+                # Each scenario runs in its own transaction
+                with_transaction()(self.run_scenario)(*scenario)
@@ -3,11 +3,19 @@
 # this repository contains the full copyright notices and license terms.
 
 from decimal import Decimal
+from fractions import Fraction
+from unittest.mock import patch
 
+from trytond.exceptions import UserError
+from trytond.model.exceptions import AccessError
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
 from trytond.pool import Pool
+from trytond.transaction import Transaction
 
-from trytond.modules.company.tests import create_company, set_company, CompanyTestMixin
+from trytond.modules.company.tests import (create_company, set_company,
+    create_employee, CompanyTestMixin)
+from trytond.modules.production_split_unexploded.production import (
+    SplitIndex, SplitMove, UomConverter, largest_remainder)
 
 
 class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
@@ -26,6 +34,12 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
         Location = pool.get('stock.location')
         Inventory = pool.get('stock.inventory')
         Move = pool.get('stock.move')
+        Configuration = pool.get('production.configuration')
+        Queue = pool.get('ir.queue')
+        Rule = pool.get('production.split.rule')
+        User = pool.get('res.user')
+        Group = pool.get('res.group')
+        ModelData = pool.get('ir.model.data')
 
         # Create Company
         company = create_company()
@@ -114,6 +128,13 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
                 production.set_moves()
                 return production
 
+            def product_quantities(moves):
+                product2quantity = {}
+                for move in moves:
+                    product2quantity[move.product] = (
+                        product2quantity.get(move.product, 0) + move.quantity)
+                return sorted(product2quantity.values())
+
             production = create_production(10)
             productions = production.split(5, unit)
             self.assertEqual(len(productions), 2)
@@ -123,8 +144,52 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
                     productions], [[10.0, 25.0], [10.0, 25.0]])
             self.assertEqual([[m.quantity for m in p.outputs] for p in
                     productions], [[5.0], [5.0]])
+            production = productions[-1]
+            self.assertEqual(productions[0].split_origin, production)
+            self.assertEqual(production.split_children, (productions[0],))
+
+            # Splitting again continues the numbering of the family
+            productions = production.split(2, unit)
+            self.assertEqual([p.number for p in productions],
+                ['1-03', '1-04', '1-01'])
+            self.assertEqual([p.quantity for p in productions], [2, 2, 1])
+            self.assertEqual(len(production.split_children), 3)
+
+            production1 = create_production(10)
+            production2 = create_production(13)
+            logs = []
+            productions = Production.split_many([production1, production2],
+                5, unit, callback=logs.append)
+            self.assertEqual(len(productions), 5)
+            log, = logs
+            self.assertEqual(log.production, None)
+            self.assertEqual(log.productions, 2)
+            self.assertEqual(log.children, 3)
+            self.assertGreater(log.creation_queries, 0)
+            self.assertGreater(log.total_time, 0)
+            self.assertEqual([p.number for p in productions],
+                ['2-02', '2-01', '3-02', '3-03', '3-01'])
+            self.assertEqual([p.quantity for p in productions],
+                [5, 5, 5, 5, 3])
+            self.assertEqual([sorted([m.quantity for m in p.inputs]) for p in
+                    productions],
+                [[10, 25], [10, 25], [10, 25], [10, 25], [6, 15]])
+            self.assertEqual([[m.quantity for m in p.outputs] for p in
+                    productions], [[5], [5], [5], [5], [3]])
 
             production = create_production(13)
+            plan = production.split_plan(5, unit)
+            self.assertEqual(plan['numbers'], [None, None, None])
+            self.assertEqual(plan['remainder'], 3)
+            fragments, move2index, move2qty = plan['inputs']
+            self.assertEqual(sorted(q for _, _, q in fragments),
+                [10, 10, 25, 25])
+            self.assertEqual(move2index, {})
+            self.assertEqual(sorted(move2qty.values()), [6, 15])
+            self.assertEqual(production.number, None)
+            self.assertEqual(production.quantity, 13)
+            self.assertEqual(sorted([m.quantity for m in production.inputs]),
+                [26, 65])
             productions = production.split(5, unit)
             self.assertEqual(len(productions), 3)
             self.assertEqual([m.quantity for m in productions], [5, 5, 3])
@@ -133,6 +198,130 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
             self.assertEqual([[m.quantity for m in p.outputs] for p in
                     productions], [[5], [5], [3]])
 
+            # Merge undoes the split
+            number = production.number[:-3]
+            Production.merge([production])
+            self.assertEqual(production.number, number)
+            self.assertEqual(production.quantity, 13)
+            self.assertEqual(production.split_children, ())
+            self.assertEqual(sorted([m.quantity for m in production.inputs]),
+                [26, 65])
+            self.assertEqual([m.quantity for m in production.outputs], [13])
+            self.assertEqual(Production.search([
+                        ('id', 'in', [p.id for p in productions[:-1]]),
+                        ]), [])
+
+            # Split by chunks of 2 productions
+            configuration = Configuration(1)
+            configuration.split_chunk_size = 2
+            configuration.save()
+            production = create_production(27)
+            Production.split_chunked([production], 5, unit)
+            number = production.number[:-3]
+            productions = Production.search([
+                    ('split_origin', '=', production.id),
+                    ], order=[('number', 'ASC')])
+            productions.insert(0, production)
+            self.assertEqual([p.number for p in productions],
+                ['%s-%02d' % (number, s) for s in range(1, 7)])
+            self.assertEqual([p.quantity for p in productions],
+                [2, 5, 5, 5, 5, 5])
+            self.assertEqual([sorted([m.quantity for m in p.inputs]) for p in
+                    productions],
+                [[4, 10]] + [[10, 25]] * 5)
+            self.assertEqual([p.split_state for p in productions],
+                [None] * 6)
+
+            # Split in parallel by batches of 1 production
+            configuration.split_batch_size = 1
+            configuration.save()
+            production1 = create_production(10)
+            production2 = create_production(10)
+            batch = Production.split_parallel([production1, production2], 5,
+                unit)
+            self.assertEqual([p.split_state for p in [
+                        production1, production2]], ['queued', 'queued'])
+            tasks = Queue.search([
+                    ('id', 'in', Transaction().tasks),
+                    ])
+            self.assertEqual(
+                [(t.data['method'], list(t.data['instances']),
+                        t.data['context']['split_batch']) for t in tasks],
+                [('split_chunked', [p.id], batch)
+                    for p in [production1, production2]])
+
+            # An unexpected error clears the split state of the batch
+            transaction = Transaction()
+            with patch.object(Production, 'iter_split',
+                    side_effect=RuntimeError), \
+                    patch.object(transaction, 'rollback'), \
+                    patch.object(transaction, 'commit'):
+                with self.assertRaises(RuntimeError):
+                    Production.split_chunked([production1, production2], 5,
+                        unit, commit=True)
+            self.assertEqual([p.split_state for p in [
+                        production1, production2]], [None, None])
+
+            production = create_production(17)
+            chunks = list(production.iter_split(5, unit, chunk_size=2))
+            self.assertEqual([(len(c), p) for c, p in chunks],
+                [(2, 1), (1, 0)])
+            self.assertEqual(production.quantity, 2)
+            self.assertEqual(production.number[-3:], '-01')
+
+            # A split stopped after a chunk is resumed within the count
+            production = create_production(30)
+            chunks = production.iter_split(5, unit, count=3, chunk_size=2)
+            self.assertEqual([(len(c), p) for c, p in [next(chunks)]],
+                [(2, 1)])
+            chunks.close()
+            self.assertEqual(Production(production.id).split_done, 2)
+            chunks = list(production.iter_split(
+                    5, unit, count=3, chunk_size=2))
+            self.assertEqual([(len(c), p) for c, p in chunks], [(1, 0)])
+            self.assertEqual(len(production.split_children), 3)
+            self.assertEqual(production.quantity, 15)
+            self.assertEqual(production.split_done, None)
+
+            production = create_production(20)
+            Production.split_chunked([production], 5, unit, count=2)
+            self.assertEqual(production.number[-3:], '-01')
+            self.assertEqual(production.quantity, 10)
+
+            # Rebalance changes only what differs
+            production = create_production(20)
+            productions = production.split(5, unit)
+            self.assertEqual(production.rebalance(5, unit), productions)
+            moves = Move.search([
+                    ('production_input', 'in', [p.id for p in productions]),
+                    ])
+            self.assertEqual(len(moves), 8)
+            productions = production.rebalance(2, unit)
+            self.assertEqual([p.quantity for p in productions], [2] * 10)
+            self.assertEqual([p.number for p in productions],
+                ['%s-%02d' % (production.number[:-3], s)
+                    for s in list(range(2, 11)) + [1]])
+            self.assertEqual([product_quantities(p.inputs)
+                    for p in productions], [[4, 10]] * 10)
+            self.assertEqual([product_quantities(p.outputs)
+                    for p in productions], [[2]] * 10)
+            productions = production.rebalance(8, unit)
+            self.assertEqual([p.quantity for p in productions], [8, 8, 4])
+            self.assertEqual([product_quantities(p.inputs)
+                    for p in productions], [[16, 40], [16, 40], [8, 20]])
+            self.assertEqual(len(production.split_children), 2)
+            Production.write([productions[0]], {'state': 'running'})
+            with self.assertRaises(UserError):
+                production.rebalance(4, unit)
+            self.assertEqual(productions[0].quantity, 8)
+            Production.write([productions[0]], {'state': 'waiting'})
+            Production.write([production], {'state': 'running'})
+            with self.assertRaises(UserError):
+                production.rebalance(4, unit)
+            with self.assertRaises(UserError):
+                Production.merge([production])
+            self.assertEqual(len(production.split_children), 2)
+
             production = create_production(7)
             productions = production.split(8, unit)
             self.assertEqual(productions, [production])
@@ -271,7 +460,12 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
             production = create_production(10)
             Production.wait([production])
             Production.assign_try([production])
+            production.assigned_by = create_employee(company)
+            production.save()
             productions = production.split(5, unit)
+            self.assertEqual(
+                [p.assigned_by for p in productions],
+                [production.assigned_by] * 2)
             self.assertEqual(len(productions), 2)
             self.assertEqual([m.quantity for m in productions], [5, 5])
             self.assertEqual([m.state for m in productions],
@@ -283,6 +477,183 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
             for p in productions:
                 self.assertEqual(all([m.state == 'draft' for m in p.outputs]),
                     True)
+                self.assertEqual([m.state for m in p.inputs],
+                    ['assigned', 'assigned'])
+
+            production = productions[-1]
+            Production.merge([production])
+            self.assertEqual(production.state, 'assigned')
+            self.assertEqual(production.quantity, 10)
+            self.assertEqual(sorted([m.quantity for m in production.inputs]),
+                [20, 50])
+            self.assertEqual([m.state for m in production.inputs],
+                ['assigned', 'assigned'])
+
+            # The cancelled moves stay in the current production
+            production = create_production(10)
+            Production.wait([production])
+            cancelled, = [m for m in production.inputs
+                if m.product == component2]
+            Move.cancel([cancelled])
+            productions = production.split(5, unit)
+            self.assertEqual([sorted((m.quantity, m.state) for m in p.inputs)
+                    for p in productions],
+                [[(25, 'draft')], [(20, 'cancelled'), (25, 'draft')]])
+
+            # Only the quantity of the assigned moves is not checked
+            move = create_production(10).inputs[0]
+            Move.cancel([move])
+            with Transaction().set_context(_production_split=True):
+                with self.assertRaises(AccessError):
+                    Move.write([move], {'quantity': 1})
+
+            # Split to the stock available shared between the productions
+            inventory, = Inventory.create([{
+                        'company': company.id,
+                        'location': storage.id,
+                        'lines': [('create', [{
+                                        'product': component1.id,
+                                        'quantity': 80,
+                                        }, {
+                                        'product': component2.id,
+                                        'quantity': 120,
+                                        }])],
+                        }])
+            Inventory.confirm([inventory])
+            production1 = create_production(10)
+            production2 = create_production(10)
+            Production.wait([production1, production2])
+            productions = Production.split_available(
+                [production1, production2])
+            self.assertEqual([p.quantity for p in productions], [6, 4, 10])
+            self.assertEqual([sorted([m.quantity for m in p.inputs]) for p in
+                    productions], [[12, 30], [8, 20], [20, 50]])
+
+            # The available steps are computed exactly
+            component3, = Product.create([{
+                        'template': template1.id,
+                        'cost_price': Decimal(1),
+                        }])
+            inventory, = Inventory.create([{
+                        'company': company.id,
+                        'location': storage.id,
+                        'lines': [('create', [{
+                                        'product': component3.id,
+                                        'quantity': 29,
+                                        }])],
+                        }])
+            Inventory.confirm([inventory])
+            production, = Production.create([{
+                        'product': product.id,
+                        'unit': unit.id,
+                        'quantity': 100,
+                        'warehouse': warehouse.id,
+                        'location': production_loc.id,
+                        'company': company.id,
+                        'inputs': [('create', [{
+                                        'product': component3.id,
+                                        'unit': unit.id,
+                                        'quantity': 100,
+                                        'from_location': storage.id,
+                                        'to_location': production_loc.id,
+                                        'company': company.id,
+                                        }])],
+                        }])
+            productions = Production.split_available([production])
+            self.assertEqual([p.quantity for p in productions], [29, 71])
+
+            # The new production takes the reservation of the assigned moves
+            component4, = Product.create([{
+                        'template': template1.id,
+                        'cost_price': Decimal(1),
+                        }])
+            inventory, = Inventory.create([{
+                        'company': company.id,
+                        'location': storage.id,
+                        'lines': [('create', [{
+                                        'product': component4.id,
+                                        'quantity': 20,
+                                        }])],
+                        }])
+            Inventory.confirm([inventory])
+            production, = Production.create([{
+                        'product': product.id,
+                        'unit': unit.id,
+                        'quantity': 10,
+                        'warehouse': warehouse.id,
+                        'location': production_loc.id,
+                        'company': company.id,
+                        'inputs': [('create', [{
+                                        'product': component4.id,
+                                        'unit': unit.id,
+                                        'quantity': quantity,
+                                        'from_location': storage.id,
+                                        'to_location': production_loc.id,
+                                        'company': company.id,
+                                        } for quantity in [20, 30]])],
+                        }])
+            Production.wait([production])
+            draft, assigned = production.inputs
+            self.assertEqual([draft.quantity, assigned.quantity], [30, 20])
+            self.assertEqual(Move.assign_try([assigned]), True)
+            productions = Production.split_available([production])
+            self.assertEqual([p.quantity for p in productions], [4, 6])
+            self.assertEqual([[(m.quantity, m.state) for m in p.inputs]
+                    for p in productions],
+                [[(20, 'assigned')], [(30, 'draft')]])
+
+            # Split in cascade the productions which supply the inputs
+            production = create_production(10)
+            input_, = [m for m in production.inputs
+                if m.product == component1]
+            move = {
+                'unit': unit.id,
+                'company': company.id,
+                }
+            supplier, = Production.create([{
+                        'product': product.id,
+                        'unit': unit.id,
+                        'quantity': 10,
+                        'warehouse': warehouse.id,
+                        'location': production_loc.id,
+                        'company': company.id,
+                        'origin': str(input_),
+                        'inputs': [('create', [dict(move,
+                                        product=component2.id,
+                                        quantity=20,
+                                        from_location=storage.id,
+                                        to_location=production_loc.id)])],
+                        'outputs': [('create', [dict(move,
+                                        product=component1.id,
+                                        quantity=50,
+                                        from_location=production_loc.id,
+                                        to_location=storage.id,
+                                        currency=company.currency.id,
+                                        unit_price=Decimal(1))])],
+                        }])
+            supplier2, = Production.create([{
+                        'product': product.id,
+                        'unit': unit.id,
+                        'quantity': 4,
+                        'warehouse': warehouse.id,
+                        'location': production_loc.id,
+                        'company': company.id,
+                        'origin': str(supplier.inputs[0]),
+                        }])
+            productions = production.split([3], unit, cascade=True)
+            self.assertEqual(productions[3], supplier)
+            self.assertEqual(productions[5], supplier2)
+            self.assertEqual([p.quantity for p in productions],
+                [3, 7, 3, 7, 1, 3])
+            self.assertEqual([m.quantity for m in productions[2].outputs], [15])
+            child, supplier = productions[2:4]
+            self.assertEqual(child.split_origin, supplier)
+            self.assertEqual(child.origin, [m for m in productions[0].inputs
+                    if m.product == component1][0])
+            self.assertEqual(supplier.origin, input_)
+            child2, supplier2 = productions[4:]
+            self.assertEqual(child2.split_origin, supplier2)
+            self.assertEqual(child2.origin, child.inputs[0])
 
             production = create_production(10)
             production.bom == None
@@ -321,5 +692,217 @@ class ProductionSplitTestCase(CompanyTestMixin, ModuleTestCase):
             self.assertEqual([sorted([m.quantity for m in p.outputs]) for p in
                     productions], [[1, 5], [1, 5]])
 
+            # Quantities not divisible by the number of productions
+            production = create_production(3)
+            component2_move, = [m for m in production.inputs
+                if m.product == component2]
+            component2_move.quantity = 10
+            component2_move.save()
+            productions = production.split(1, unit)
+            self.assertEqual([p.quantity for p in productions], [1, 1, 1])
+            self.assertEqual([[m.quantity for m in p.inputs
+                        if m.product == component2] for p in productions],
+                [[4], [3], [3]])
+
+            # Split into a list of quantities or equal parts
+            production = create_production(13)
+            productions = production.split([5, 3, 2, 4], unit)
+            self.assertEqual([p.quantity for p in productions], [5, 3, 2, 3])
+            self.assertEqual([sorted([m.quantity for m in p.inputs]) for p in
+                    productions], [[10, 25], [6, 15], [4, 10], [6, 15]])
+            production = create_production(10)
+            productions = production.split_parts(3, unit)
+            self.assertEqual([p.quantity for p in productions], [4, 3, 3])
+            self.assertEqual([sorted([m.quantity for m in p.inputs]) for p in
+                    productions], [[8, 20], [6, 15], [6, 15]])
+
+            # Split many productions in a single call
+            production1 = create_production(10)
+            production2 = create_production(13)
+            results = Production.split_entries([
+                    (production1.id, 5, unit.id),
+                    (production2.id, 5, unit.id, 1),
+                    (production1.id, 5, unit.id),
+                    (-1, 5, unit.id),
+                    (production.id, 5, unit.id + 1000),
+                    (create_production(10).id, 0, unit.id),
+                    (create_production(10).id, 10, unit.id),
+                    ])
+            self.assertEqual([r['error'] for r in results],
+                [None, None, 'duplicate', 'missing', 'unit',
+                    'invalid_quantity', 'not_split'])
+            self.assertEqual([len(r['productions']) for r in results],
+                [1, 1, 0, 0, 0, 0, 0])
+            self.assertEqual(results[0]['numbers'],
+                [p.number for p in production1.split_children])
+            self.assertEqual(results[1]['number'], production2.number)
+            self.assertEqual(production2.quantity, 8)
+
+            # Split by the rules when the moves are set
+            rule, = Rule.create([{
+                        'product': product.id,
+                        'warehouse': warehouse.id,
+                        'quantity': 2,
+                        'unit': box5.id,
+                        'count': 2,
+                        }])
+            production1 = create_production(25)
+            production2 = create_production(8)
+            self.assertEqual([p.quantity for p in production1.split_children],
+                [2, 2])
+            self.assertEqual(production1.quantity, 1)
+            self.assertEqual(production1.unit, box5)
+            self.assertEqual(production2.split_children, ())
+            self.assertEqual(production2.quantity, 8)
+
+            # The cron splits the pending productions by the rules in background
+            with Transaction().set_context(_production_split=True):
+                production1 = create_production(30)
+            batches = Production.split_by_rules_parallel()
+            self.assertEqual(production1.split_state, 'queued')
+            self.assertEqual(production2.split_state, None)
+            tasks = Queue.search([
+                    ('id', 'in', Transaction().tasks),
+                    ])
+            self.assertIn(('split_chunked', [production1.id], 2, box5.id, 2),
+                [(t.data['method'], list(t.data['instances']))
+                    + tuple(t.data['args']) for t in tasks
+                    if t.data['context'].get('split_batch') in batches])
+
+            # Split as a user of production without access to the logs
+            user, = User.create([{
+                        'name': 'Production',
+                        'login': 'production',
+                        'companies': [('add', [company.id])],
+                        'company': company.id,
+                        'groups': [('add', [
+                                    Group(ModelData.get_id(
+                                            'production', 'group_production')),
+                                    Group(ModelData.get_id('production',
+                                            'group_production_admin')),
+                                    ])],
+                        }])
+            with Transaction().set_user(user.id), \
+                    Transaction().set_context(_check_access=True):
+                production = create_production(8)
+                productions = production.split(5, unit)
+                self.assertEqual([p.quantity for p in productions], [5, 3])
+
+                # The rules also split the productions created by the user
+                production = create_production(25)
+                self.assertEqual(
+                    [p.quantity for p in production.split_children], [2, 2])
+                self.assertEqual(production.quantity, 1)
+
+                # The entries of the locked productions get their own error
+                production1 = create_production(8)
+                production2 = create_production(8)
+                with patch.object(Production, '_split_try_lock',
+                        return_value={production2}):
+                    results = Production.split_entries([
+                            (production1.id, 5, unit.id),
+                            (production2.id, 5, unit.id),
+                            ])
+                self.assertEqual([r['error'] for r in results],
+                    [None, 'locked'])
+                self.assertEqual([r['number'] for r in results],
+                    [production1.number, production2.number])
+                self.assertEqual(
+                    [production1.quantity, production2.quantity], [3, 8])
+
+    @with_transaction()
+    def test0020uom_converter(self):
+        'Test UoM converter'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        convert = UomConverter()
+        uoms = Uom.search([
+                ('category.name', '=', 'Weight'),
+                ])
+        for from_uom in uoms:
+            for to_uom in uoms:
+                for qty in [0, 1, 3.3, 1234.56789]:
+                    self.assertEqual(convert(from_uom, qty, to_uom),
+                        Uom.compute_qty(from_uom, qty, to_uom, round=False))
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        with self.assertRaises(ValueError):
+            convert(unit, 1, uoms[0])
+
+    def test0030largest_remainder(self):
+        'Test largest remainder'
+        self.assertEqual(largest_remainder(10, [1, 1, 1]), [4, 3, 3])
+        self.assertEqual(largest_remainder(10, [1, 2, 2]), [2, 4, 4])
+        self.assertEqual(largest_remainder(7, [0, 0]), [0, 0])
+        self.assertEqual(sum(largest_remainder(1000, [1] * 7)), 1000)
+
+    @with_transaction()
+    def test0040split_lots(self):
+        'Test split keeping the lots whole'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Production = pool.get('production')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        moves = [SplitMove(move=name, key=1, product=1, quantity=quantity,
+                state='draft', unit=unit, default_uom=unit, lot=lot)
+            for name, quantity, lot in [
+                ('a', 30, 1), ('b', 30, 2), ('c', 10, 3), ('d', 10, None)]]
+        a, b, c, d = moves
+        fragments, move2index, move2qty = Production()._plan_split_moves(
+            moves, [Fraction(45, 80)])
+        # The lots which fit are taken whole and the move without lot is cut
+        self.assertEqual(fragments, [(d, 0, 5)])
+        self.assertEqual(move2index, {a: 0, c: 0})
+        self.assertEqual(move2qty, {a: 30, b: 30, c: 10, d: 5})
+
+    @with_transaction()
+    def test0045split_small_move(self):
+        'Test split of a move smaller than a rounding step'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Production = pool.get('production')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        five, = Uom.create([{
+                    'name': 'Five',
+                    'symbol': '5',
+                    'category': unit.category.id,
+                    'factor': 1,
+                    'rate': 1,
+                    'rounding': 5,
+                    'digits': 0,
+                    }])
+        move = SplitMove(move='a', key=1, product=1, quantity=2,
+            state='draft', unit=five, default_uom=five, lot=None)
+        fragments, move2index, move2qty = Production()._plan_split_moves(
+            [move], [Fraction(1, 2)])
+        self.assertEqual(fragments, [])
+        self.assertEqual(move2index, {})
+        self.assertEqual(move2qty, {move: 2})
+
+    @with_transaction()
+    def test0050split_index(self):
+        'Test split index'
+        pool = Pool()
+        Uom = pool.get('product.uom')
+
+        minute, = Uom.search([('name', '=', 'Minute')])
+        hour, = Uom.search([('name', '=', 'Hour')])
+        moves = [SplitMove(move=name, key=key, product=1, quantity=quantity,
+                state='draft', unit=uom, default_uom=minute, lot=None)
+            for name, key, quantity, uom in [
+                ('a', 1, 10, minute), ('b', 2, 5, minute), ('c', 1, 1, hour),
+                ('d', 1, 3, minute)]]
+        index = SplitIndex(moves)
+        self.assertEqual(index.keys(), [1, 2])
+        self.assertEqual([m.move for m in index.moves(1)], ['a', 'c', 'd'])
+        self.assertEqual(index.quantities(1), [10, 60, 3])
+        self.assertEqual(index.total(1), 73)
+        self.assertEqual(index.span(1, 1), (10, 70))
+        self.assertEqual(
+            [index.find(1, p) for p in [0, 9, 10, 70, 73]], [0, 0, 1, 2, 2])
+
 
 del ModuleTestCase